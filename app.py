@@ -1,48 +1,151 @@
-from flask import Flask, redirect, request, url_for, render_template, session, abort, jsonify
+from flask import Blueprint, Flask, Response, current_app, g, redirect, request, url_for, render_template, send_from_directory, session, abort, jsonify, stream_with_context
+import click
 import json
-import pandas as pd
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import matplotlib.ticker as ticker
-import requests
+import logging
+import time
 import os
-from flask_sqlalchemy import SQLAlchemy
+import strava_client
+from jobs import SyncQueue
+from tokens import TokenManager
+from instrumentation import metrics, span, timed, render_gauges, RequestProfiler
+from plot_cache import PlotCache
+from render_pool import PlotRenderer
+from shoes import LRUCache, get_shoe_mapping, replace_shoes, invalidate_shoe_mapping, backfill_gear
 from models import db, User, Activity  # Import db and User from models.py
-from datetime import datetime
-from flask_migrate import Migrate
-from sqlalchemy import create_engine
+from database import engine_options, is_sqlite, configure_sqlite
+from rollups import apply_run_changes, rebuild_shoe_stats, backfill_paces, run_paces
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 
+# pandas (stats.py), matplotlib (plots.py) and alembic (flask_migrate) are imported on first use,
+# so a cold instance serves / and the OAuth callback without paying for them. Set
+# PRELOAD_ANALYTICS=1 to load them in each gunicorn worker before it serves, see gunicorn.conf.py.
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Leveled logging, LOG_LEVEL=DEBUG also logs each stage of the stats pipeline
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger(__name__)
+
 # Access environment variables
 client_id = os.getenv("STRAVA_CLIENT_ID")
 client_secret = os.getenv("STRAVA_CLIENT_SECRET")
 
-app = Flask(__name__)
-app.secret_key = os.getenv("SHOE_INSIGHTS_SECRET_KEY")
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///app.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-migrate = Migrate(app, db)
+# Every route and CLI command of the app, registered on the app by create_app()
+bp = Blueprint('insights', __name__, cli_group=None)
+
+# Page sizes of /activities and /users, and rows fetched per round trip when streaming NDJSON
+DEFAULT_PAGE_SIZE = int(os.getenv('DEFAULT_PAGE_SIZE', '1000'))
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', '10000'))
+STREAM_BATCH_SIZE = 500
+
+# Rendered plots, kept in PLOT_CACHE_DIR (static/plot_cache by default), served from /plots/ and
+# bounded to PLOT_CACHE_MAX_BYTES on disk
+PLOT_KINDS = ('scatter_plot', 'box_plot_no_outliers', 'pace_distance_scatter_plot')
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+plot_cache = PlotCache(os.getenv('PLOT_CACHE_DIR', os.path.join(STATIC_FOLDER, 'plot_cache')),
+                       max_bytes=int(os.getenv('PLOT_CACHE_MAX_BYTES', str(200 * 1024 * 1024))))
+
+# Shoe trends of /api/shoes/<athlete_id>/trends: (athlete_id, days, runs, freq) -> (plot fingerprint, payload).
+# Bounded in payloads rather than athletes, every window a client asks for is a separate entry.
+TRENDS_MAX_DAYS = 3650
+TRENDS_MAX_RUNS = 1000
+trends_cache = LRUCache(maxsize=int(os.getenv('TRENDS_CACHE_SIZE', '256')))
+
+# Worker processes rendering the plots in parallel, started in the background by the first plot
+# rendered (or up front by preload_analytics() with PRELOAD_ANALYTICS). Plots are rendered inline on
+# the request thread until the workers are ready, and always with PLOT_WORKERS=0.
+plot_renderer = PlotRenderer(workers=int(os.getenv('PLOT_WORKERS', '3')))
+
+# Access tokens kept in memory and refreshed TOKEN_REFRESH_MARGIN seconds before they expire
+token_manager = TokenManager(lambda user: request_token_refresh(user),  # request_token_refresh is defined below
+                             margin=int(os.getenv('TOKEN_REFRESH_MARGIN', '300')))
+
+# Background workers for /fetch_activities, so a long backfill doesn't hold a request thread
+sync_queue = SyncQueue(lambda job: run_sync_job(job),  # run_sync_job is defined below
+                       workers=int(os.getenv('SYNC_WORKERS', '2')))
+
+# Set PROFILE_REQUESTS_DIR to dump a cProfile of requests into that directory, one request at a time
+request_profiler = RequestProfiler(os.getenv('PROFILE_REQUESTS_DIR')) if os.getenv('PROFILE_REQUESTS_DIR') else None
+
+def create_app():
+    app = Flask(__name__, static_folder=STATIC_FOLDER)
+    app.secret_key = os.getenv("SHOE_INSIGHTS_SECRET_KEY")
+    # DATABASE_URL points the app at another database, e.g. PostgreSQL in production or the one
+    # filled by benchmarks/generate_data.py. Pool and SQLite settings are read in database.py.
+    database_url = os.getenv('DATABASE_URL', 'sqlite:///app.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(database_url)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    if is_sqlite(database_url):
+        with app.app_context():
+            configure_sqlite(db.engine)
+
+    # DB_SCHEMA=create creates missing tables at startup, upgrade applies the Flask-Migrate
+    # migrations and none leaves the schema to `flask db upgrade` or an operator
+    schema = os.getenv('DB_SCHEMA', 'create')
+    if schema not in ('create', 'upgrade', 'none'):
+        raise ValueError(f"DB_SCHEMA must be create, upgrade or none, not {schema!r}")
+
+    # Flask-Migrate imports alembic, which only the `flask db` commands and DB_SCHEMA=upgrade need
+    if schema == 'upgrade' or click.get_current_context(silent=True) is not None:
+        from flask_migrate import Migrate
+        Migrate(app, db, render_as_batch=True)  # SQLite alters tables by copying them
+
+    app.register_blueprint(bp)
+    sync_queue.init_app(app)
 
-db.init_app(app)
+    with app.app_context():
+        if schema == 'create':
+            db.create_all()
+        elif schema == 'upgrade':
+            from flask_migrate import upgrade
+            upgrade()
+    return app
+
+def preload_analytics():
+    # Import pandas and matplotlib and start the plot rendering pool now rather than on the first
+    # stats page. Called from gunicorn's post_fork hook when PRELOAD_ANALYTICS is set.
+    import stats  # noqa: F401
+    import plots  # noqa: F401
+    plot_renderer.start()
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if request_profiler:
+        request_profiler.start()
+
+@bp.teardown_app_request
+def record_request_time(exc):
+    start = g.pop('request_start', None)
+    if start is not None:
+        metrics.observe(f'request.{request.endpoint}', time.perf_counter() - start)
+    if request_profiler:
+        request_profiler.stop(request.endpoint)
+
+@bp.route('/metrics')
+def prometheus_metrics():
+    # Span latencies and the Strava request budget in the Prometheus text format
+    body = metrics.render() + render_gauges('shoe_insights_strava', strava_client.rate_limiter.metrics(),
+                                            'Strava API request budget, see /metrics/strava.')
+    return Response(body, mimetype='text/plain; version=0.0.4')
 
 # Route to initiate OAuth2 authorization flow
-@app.route('/authorize')
+@bp.route('/authorize')
 def authorize():
     # Construct the URL for Strava's authorization page
-    strava_auth_url = 'https://www.strava.com/oauth/authorize'
+    strava_auth_url = f'{strava_client.STRAVA_OAUTH_URL}/authorize'
     redirect_uri = 'http://127.0.0.1:5000/authorization/callback'  # Replace with your redirect URI
     scope = 'profile:read_all,activity:read_all'  # Replace with the desired scope
     auth_url = f'{strava_auth_url}?client_id={client_id}&redirect_uri={redirect_uri}&response_type=code&scope={scope}'
-    print("I CREATED AN AUTH URL!")
+    logger.debug("Redirecting to the Strava authorization page")
     # Redirect the user to Strava's authorization page
     return redirect(auth_url)
 
-@app.route('/authorization/callback')
+@bp.route('/authorization/callback')
 def authorization_callback():
     error = request.args.get('error')
     if error == 'access_denied':
@@ -52,17 +155,24 @@ def authorization_callback():
         code = request.args.get('code')
 
         # Make a POST request to exchange the authorization code for an access token
-        token_url = 'https://www.strava.com/oauth/token'
+        token_url = f'{strava_client.STRAVA_OAUTH_URL}/token'
         data = {
             'client_id': 124834,
             'client_secret': client_secret,
             'code': code,
             'grant_type': 'authorization_code'
         }
-        response = requests.post(token_url, data=data)
+        # On the request thread: fail fast rather than wait for Strava's rate limit window
+        try:
+            response = strava_client.post(token_url, data=data, wait=False)
+        except strava_client.RateLimitExceeded as e:
+            logger.warning("Token exchange not sent: %s", e)
+            response = None
+        if response is None or response.status_code == 429:
+            return "Error: Strava's request limit is reached, please try again in a few minutes.", 503
 
         # Log the status code of the response
-        print("Response status code:", response.status_code)
+        logger.info("Token exchange response status code: %s", response.status_code)
 
         # Handle the response from Strava
         if response.status_code == 200:
@@ -73,7 +183,6 @@ def authorization_callback():
             refresh_token = response_json.get('refresh_token')
             expires_at = response_json.get('expires_at')
             scope = response_json.get('scope')
-            print("I GOT THE RESPONSE!")
 
             # Check if the user already exists in the database
             existing_user = User.query.filter_by(athlete_id=athlete_id).first()
@@ -84,9 +193,10 @@ def authorization_callback():
                 existing_user.refresh_token = refresh_token
                 existing_user.expires_at = expires_at
                 existing_user.scope = scope
-                db.session.commit()# Call get_and_update_athlete_summary with existing_user
+                db.session.commit()
+                token_manager.store(existing_user.id, access_token, expires_at)
+                # Call get_and_update_athlete_summary with existing_user
                 get_and_update_athlete_summary(existing_user)
-                print("I CALLED A get_and_update_athlete_summary(existing_user) FUNCTION!")
 
                 new_user_id = existing_user.id
             else:
@@ -100,82 +210,73 @@ def authorization_callback():
                 )
                 db.session.add(user)
                 db.session.commit()
-                print("I STORED THE NEW USER INFO IN THE DATABASE!")
+                logger.info("Stored new user for athlete %s", athlete_id)
                 new_user_id = user.id
                 
                 # Get and update athlete summary
                 get_and_update_athlete_summary(user)
-                print("I CALLED A get_and_update_athlete_summary(user) FUNCTION!")
 
-            return redirect(url_for('authorization_success', user_id=new_user_id))
+            return redirect(url_for('.authorization_success', user_id=new_user_id))
         else:
             return "Error: Unable to retrieve access token."
 
 def deauthorize_user(access_token):
-    deauth_url = 'https://www.strava.com/oauth/deauthorize'
+    deauth_url = f'{strava_client.STRAVA_OAUTH_URL}/deauthorize'
     params = {'access_token': access_token}
-    response = requests.post(deauth_url, params=params)
+    try:
+        response = strava_client.post(deauth_url, params=params, wait=False)
+    except strava_client.RateLimitExceeded as e:
+        logger.warning("Deauthorization not sent: %s", e)
+        return False
 
     if response.status_code == 200:
         return True  # Deauthorization successful
     else:
         return False  # Deauthorization failed
             
-@app.route('/')
+@bp.route('/')
 def main_page():
     return render_template('main_page.html')  # Replace 'main_page.html' with the name of your HTML template
 
-# Function to refresh the access token if it has expired
+# Function to get a valid access token, refreshed shortly before it expires. Concurrent
+# callers for one user share a single refresh request.
 def refresh_access_token(user):
-    current_time = datetime.now().timestamp()
-    if user.expires_at <= current_time:
-        # Access token has expired, refresh it
-        token_url = 'https://www.strava.com/oauth/token'
-        data = {
-            'client_id': 'YOUR_CLIENT_ID',
-            'client_secret': 'YOUR_CLIENT_SECRET',
-            'refresh_token': user.refresh_token,
-            'grant_type': 'refresh_token'
-        }
-        response = requests.post(token_url, data=data)
-
-        # Handle the response from Strava
-        if response.status_code == 200:
-            response_json = response.json()
-            new_access_token = response_json.get('access_token')
-            new_refresh_token = response_json.get('refresh_token')  # Optional: Refresh token may or may not change
-            new_expires_at = response_json.get('expires_at')
-
-            # Update user's access token in the database
-            user.access_token = new_access_token
-            user.refresh_token = new_refresh_token
-            user.expires_at = new_expires_at
-            db.session.commit()
-
-            return new_access_token
-        else:
-            # Failed to refresh access token
-            return None
-    else:
-        # Access token is still valid
-        return user.access_token
-
-# Functions to format seconds to mm:ss format
-def convert_to_mm_ss(seconds):
-    minutes, remainder = divmod(seconds, 60)
-    return '{:02d}:{:02d}'.format(int(minutes), int(remainder))
+    return token_manager.access_token(user)
+
+def request_token_refresh(user):
+    # Exchange the refresh token for a new access token, raises strava_client.StravaAPIError on failure
+    token_url = f'{strava_client.STRAVA_OAUTH_URL}/token'
+    data = {
+        'client_id': client_id,
+        'client_secret': client_secret,
+        'refresh_token': user.refresh_token,
+        'grant_type': 'refresh_token'
+    }
+    response = strava_client.post(token_url, data=data)
+
+    # Handle the response from Strava
+    if response.status_code != 200:
+        raise strava_client.StravaAPIError(response)
+
+    response_json = response.json()
+    new_access_token = response_json.get('access_token')
+    new_refresh_token = response_json.get('refresh_token')  # Optional: Refresh token may or may not change
+    new_expires_at = response_json.get('expires_at')
+
+    # Update user's access token in the database
+    user.access_token = new_access_token
+    user.refresh_token = new_refresh_token or user.refresh_token
+    user.expires_at = new_expires_at
+    db.session.commit()
 
-def format_seconds(x, pos):
-    minutes = int(x // 60)
-    seconds = int(x % 60)
-    return f"{minutes:02d}:{seconds:02d}"
+    return new_access_token, new_expires_at
 
 #@app.route('/trigger_runstats/<int:athlete_id>', methods=['POST'])
 #def trigger_runstats(athlete_id):
     # Directly trigger the stats_page route
     return jsonify({'status': 'success'})
 
-@app.route('/stats_page/<int:athlete_id>', methods=['GET', 'POST'])
+@bp.route('/stats_page/<int:athlete_id>', methods=['GET', 'POST'])
 def stats_page(athlete_id):
     try:
         shoe_stats_data, scatter_plot_filename, box_plot_filename, pace_distance_scatter_plot_filename = runstats(athlete_id)
@@ -188,160 +289,142 @@ def stats_page(athlete_id):
     except Exception as e:
         return str(e), 500
 
-@app.route('/runstats/<int:athlete_id>')
+@bp.route('/runstats/<int:athlete_id>')
+@timed('runstats')
 def runstats(athlete_id):
-    print("I ENTERED THE INDEX ROUTE!")
-    #print("Athlete ID:", athlete_id)  # Log the athlete_id
+    # pandas is only imported by the first stats request of a process
+    import stats
 
-    # Query all activities using SQLAlchemy's ORM
-    activities = Activity.query.filter_by(athlete_id=athlete_id).all()
+    logger.debug("Computing stats of athlete %s", athlete_id)
 
-    # Convert the queried activities into a list of dictionaries
-    activity_data = []
-    for activity in activities:
-        activity_data.append({
-            'athlete_id': activity.athlete_id,
-            'activity_id': activity.activity_id,
-            'activity_date': activity.activity_date,
-            'activity_type': activity.activity_type,
-            'elapsed_time': activity.elapsed_time,
-            'moving_time': activity.moving_time,
-            'distance': activity.distance,
-            'average_speed': activity.average_speed,
-            'gear_id': activity.gear_id,
-            'pace': activity.pace
-        })
-    print("I COPIED ALL ACTIVITIES INTO THE ACTIVITY_DATA ARRAY!")
-
-    # Convert the list of dictionaries into a DataFrame
-    activities_df = pd.DataFrame(activity_data)
-    print("I CONVERTED ACTIVITY_DATA INTO THE ACTIVITIES_DF!")
-
-    # Filter records where Activity Type is 'Run'
-    df = activities_df[activities_df['activity_type'] == 'Run']
-    print("I FILTERED THE ACTIVITIES_DF TO ONLY INCLUDE RUNS!")
-
-    # Convert 'distance' column to numeric
-    df.loc[:, 'distance'] = pd.to_numeric(df['distance'], errors='coerce')
-    print("I CONVERTED THE DISTANCE COLUMN TO NUMERIC!")
-
-    # Convert speed from meters per second into pace format with seconds per kilometer
-    df.loc[:, 'pace'] = 1 / df['average_speed'] * 1000
-    print("I FILLED THE PACE COLUMN BASED ON AVERAFE SPEED!")
-
-    # Convert seconds per kilometer to integer format
-    df.loc[:, 'pace'] = df['pace'].astype(int)
-    print("I CONVERTED THE PACE COLUMN TO INTEGER FORMAT!")
-
-    # Fetch the shoe data from the User table and create a dictionary mapping gear IDs to shoe names
-    shoe_mapping = {}
-
-    # Fetch the current user data
-    current_user = User.query.filter_by(athlete_id=athlete_id).first()
-
-    # Fetch the shoe data from the User table and create a dictionary mapping gear IDs to shoe names
-    current_user = User.query.filter_by(athlete_id=athlete_id).first()
-    if current_user:
-        shoes_data = json.loads(current_user.shoes)
-        shoe_mapping = {shoe['id']: shoe['name'] for shoe in shoes_data}
-    else:
-        shoe_mapping = {}
+    # Plots are cached on disk until the athlete's runs or shoes change, a cached plot costs no
+    # matplotlib work at all. Read before any data, so plots drawn from data changed meanwhile are
+    # filed under the older fingerprint and redrawn by the next request.
+    fingerprint = plot_fingerprint(athlete_id)
+
+    # Fetch the mapping of gear IDs to shoe names, cached until the athlete's shoes change
+    with span('runstats.shoe_mapping'):
+        shoe_mapping = get_shoe_mapping(athlete_id)
+
+    if not shoe_mapping:
+        logger.warning("Shoe mapping not found for athlete %s", athlete_id)
+
+    # Calculate the number of runs, average pace, and average distance for each shoe
+    shoe_stats = stats.shoe_stats_table(athlete_id, shoe_mapping)
+
+    with span('runstats.format_table'):
+        # Keep the average pace in seconds for the scatter plot
+        average_pace_seconds = shoe_stats['Average Pace']
+
+        # Convert average pace from seconds to mm:ss format
+        shoe_stats['Average Pace'] = stats.convert_to_mm_ss(shoe_stats['Average Pace'])
+
+        # Round the average distance to two digits after the comma
+        shoe_stats['Average Distance'] = (shoe_stats['Average Distance'] / 1000).round(2)
+
+        # Sort the shoe statistics by the number of runs in descending order
+        shoe_stats = shoe_stats.sort_values(by='Number of Runs', ascending=False)
+
+        # Prepare data for rendering in HTML template
+        shoe_stats_data = shoe_stats.to_dict(orient='records')
 
-    # Replace gear IDs with shoe names in the DataFrame
-    if shoe_mapping:
-        df['gear_id'] = df['gear_id'].map(shoe_mapping)
-        print("I MAPPED GEAR IDS TO SHOE NAMES!")
+    plot_paths = {kind: plot_cache.get(athlete_id, kind, fingerprint) for kind in PLOT_KINDS}
+
+    # Render the missing plots together, in parallel when the plot rendering pool is running
+    missing = [kind for kind in PLOT_KINDS if plot_paths[kind] is None]
+    if missing:
+        # Neither is matplotlib while every plot comes from the cache
+        import plots
+
+        jobs = {}
+        if 'scatter_plot' in missing:
+            jobs['scatter_plot'] = (plots.render_scatter_plot, (shoe_stats['Gear'], average_pace_seconds))
+
+        if 'box_plot_no_outliers' in missing:
+            jobs['box_plot_no_outliers'] = (plots.render_box_plot, (stats.box_plot_stats(athlete_id, shoe_mapping),))
+
+        # The pace vs distance plot shows every run, so only load the individual runs if it has to be rendered
+        if 'pace_distance_scatter_plot' in missing:
+            df = stats.load_runs(athlete_id, shoe_mapping)
+            jobs['pace_distance_scatter_plot'] = (plots.render_pace_distance_plot, (df,))
+
+        with span('runstats.render_plots'):
+            plot_paths.update(plot_cache.put_all(athlete_id, fingerprint, missing,
+                                                 lambda paths: plot_renderer.render(jobs, paths)))
     else:
-        print("Shoe mapping not found!")
-        df['gear_id'] = "Unknown"  # Assign a placeholder value for gear IDs if mapping is not found
-    
-    # Group by 'gear_id' and calculate the number of runs, average pace, and average distance for each shoe
-    shoe_stats = df.groupby('gear_id').agg({'activity_id': 'count', 'pace': 'mean', 'distance': 'mean'}).reset_index()
-    shoe_stats.columns = ['Gear', 'Number of Runs', 'Average Pace', 'Average Distance']
-    print("I GROUPED BY GEAR_ID AND CALCULATED THE NUMBER OF RUNS, AVERAGE PACE, AND AVERAGE DISTANCE FOR EACH SHOE!")  
-
-    # Convert average pace from seconds to mm:ss format
-    shoe_stats['Average Pace'] = shoe_stats['Average Pace'].apply(convert_to_mm_ss)
-    print("I CONVERTED AVERAGE PACE FROM SECONDS TO MM:SS FORMAT!") 
-
-    # Round the average distance to two digits after the comma
-    shoe_stats['Average Distance'] = (shoe_stats['Average Distance'] / 1000).round(2)
-    print("I ROUNDED THE AVERAGE DISTANCE TO TWO DECIMALS AFTER THE COMMA!")
-
-    # Sort the shoe statistics by the number of runs in descending order
-    shoe_stats = shoe_stats.sort_values(by='Number of Runs', ascending=False)
-    print("I SORTED THE SHOE STATISTICS BY THE NUMBER OF RUNS IN DESCENDING ORDER!")
-
-    # Prepare data for rendering in HTML template
-    shoe_stats_data = shoe_stats.to_dict(orient='records')
-    print("I PREPARED THE TABLE DATA FOR RENDERING IN THE HTML TEMPLATE!")
-
-    # Scatter Plot: Shoe Performance
-    plt.figure(figsize=(8, 6))
-    plt.scatter(shoe_stats['Gear'], shoe_stats['Average Pace'])
-    plt.xlabel('Shoe')
-    plt.ylabel('Average Pace (min/km)')
-    print("I CREATED THE SCATTER PLOT!")
-
-    # Set custom tick formatter for Y-axis
-    plt.gca().yaxis.set_major_formatter(ticker.FuncFormatter(format_seconds))
-
-    plt.xticks(rotation=45, ha='right')
-    plt.tight_layout()
-
-    scatter_plot_filename = 'static/scatter_plot.png'
-    plt.savefig(scatter_plot_filename, format='png')
-    plt.close()  # Clear the current figure
-    print("I SAVED THE SCATTER PLOT!")
-
-    # Box Plot: Shoe Performance with outliers excluded
-    plt.figure(figsize=(8, 6))
-    box_plot = df.boxplot(column='pace', by='gear_id', showfliers=False, figsize=(8, 6))
-    box_plot.set_title('')  # Remove the title "Boxplot grouped by Gear"
-    plt.xlabel('')  # Remove X-axis label
-    plt.ylabel('Pace (min/km)')
-    plt.xticks(rotation=45, ha='right')
-    print("I CREATED THE BOX PLOT!")
-
-    # Set custom tick formatter for Y-axis
-    box_plot.yaxis.set_major_formatter(ticker.FuncFormatter(format_seconds))
-
-    plt.tight_layout()
-    box_plot_filename = 'static/box_plot_no_outliers.png'
-    plt.savefig(box_plot_filename, format='png')
-    plt.close()  # Clear the current figure
-    print("I SAVED THE BOX PLOT!")
-
-    # Scatter Plot: Pace vs Distance
-    plt.figure(figsize=(8, 6))
-    print("I CREATED THE SCATTER PLOT-2!")
-
-    # Define a list of colors for each shoe
-    colors = ['b', 'g', 'r', 'c', 'm', 'y', 'k']
-
-    # Loop through each unique shoe and plot its data with a different color
-    for i, (shoe, group) in enumerate(df.groupby('gear_id')):
-        plt.scatter(group['distance'], group['pace'], label=shoe, color=colors[i % len(colors)])
-
-    plt.xlabel('Distance (m)')
-    plt.ylabel('Pace (min/km)')
-    plt.title('Scatter Plot: Pace vs Distance')
-
-    # Set custom tick formatter for Y-axis
-    plt.gca().yaxis.set_major_formatter(ticker.FuncFormatter(format_seconds))
-
-    plt.legend()  # Show legend with shoe names
-    plt.tight_layout()
-
-    pace_distance_scatter_plot_filename = 'static/pace_distance_scatter_plot.png'
-    plt.savefig(pace_distance_scatter_plot_filename, format='png')
-    plt.close()  # Clear the current figure
-    print("I SAVED THE SCATTER PLOT-2!")
+        logger.debug("Served all plots of athlete %s from the cache", athlete_id)
+
+    # Filenames in the plot cache, for url_for('.plot_file', ...)
+    scatter_plot_filename, box_plot_filename, pace_distance_scatter_plot_filename = (
+        os.path.basename(plot_paths[kind]) for kind in PLOT_KINDS
+    )
 
     # Render the HTML template with the data
     return shoe_stats_data, scatter_plot_filename, box_plot_filename, pace_distance_scatter_plot_filename
 
-@app.route('/logout')
+@bp.route('/plots/<path:filename>')
+def plot_file(filename):
+    return send_from_directory(plot_cache.directory, filename)
+
+@timed('runstats.plot_fingerprint')
+def plot_fingerprint(athlete_id):
+    # The athlete's data version, bumped in the same transaction as every change of their runs or shoes
+    version = db.session.execute(
+        db.select(db.func.max(User.data_version)).where(User.athlete_id == athlete_id)
+    ).scalar()
+    return f'v{version or 0}'
+
+def bump_data_version(athlete_id):
+    # Call before committing a change of the athlete's runs or shoes, so the plots and trends cached
+    # under the previous fingerprint are never served again, by any process
+    db.session.execute(
+        db.update(User).where(User.athlete_id == athlete_id).values(data_version=User.data_version + 1)
+    )
+
+def invalidate_cached_stats(athlete_id):
+    # After the athlete's runs or shoes changed, to free the entries of this process early. Other
+    # processes stop using theirs through the fingerprint.
+    plot_cache.invalidate(athlete_id)
+    trends_cache.pop_where(lambda key: key[0] == athlete_id)
+
+@bp.route('/api/shoes/<int:athlete_id>/trends')
+@timed('trends')
+def shoe_trends(athlete_id):
+    # Cumulative distance and rolling pace of every shoe over time, to compare shoe wear with pace:
+    # ?days=<pace window in days, 30>&runs=<pace window in runs, 50>&freq=run|day|week|month (day)
+    import stats
+
+    days = request.args.get('days', 30, type=int)
+    window_runs = request.args.get('runs', 50, type=int)
+    freq = request.args.get('freq', 'day')
+    if not 0 < days <= TRENDS_MAX_DAYS:
+        abort(400, f"days must be between 1 and {TRENDS_MAX_DAYS}")
+    if not 0 < window_runs <= TRENDS_MAX_RUNS:
+        abort(400, f"runs must be between 1 and {TRENDS_MAX_RUNS}")
+    if freq not in stats.TREND_FREQUENCIES:
+        abort(400, f"freq must be one of {', '.join(stats.TREND_FREQUENCIES)}")
+    if db.session.execute(db.select(User.id).filter_by(athlete_id=athlete_id)).first() is None:
+        abort(404, "User not found")
+
+    # Cached until the athlete's runs or shoes change, like the plots
+    key = (athlete_id, days, window_runs, freq)
+    fingerprint = plot_fingerprint(athlete_id)
+    cached = trends_cache.get(key)
+    if cached is not None and cached[0] == fingerprint:
+        return jsonify(cached[1])
+
+    shoe_mapping = get_shoe_mapping(athlete_id)
+    payload = {
+        'athlete_id': athlete_id,
+        'windows': {'days': days, 'runs': window_runs},
+        'freq': freq,
+        'shoes': stats.shoe_trends(stats.load_trend_runs(athlete_id), shoe_mapping,
+                                   days=days, window_runs=window_runs, freq=freq)
+    }
+    trends_cache.put(key, (fingerprint, payload))
+    return jsonify(payload)
+
+@bp.route('/logout')
 def logout():
     if 'access_token' in session:
         access_token = session['access_token']
@@ -350,31 +433,39 @@ def logout():
             # Clear the user's session
             session.pop('access_token', None)
             # Redirect to the main page or login page
-            return redirect(url_for('main_page'))
+            return redirect(url_for('.main_page'))
         else:
             # Handle deauthorization failure
             return "Failed to deauthorize user", 500
     else:
         # User not logged in
-        return redirect(url_for('main_page'))
+        return redirect(url_for('.main_page'))
 
 # Function to make API call to get athlete summary and update user info
 def get_and_update_athlete_summary(user):
-    access_token = user.access_token
-    headers = {'Authorization': f'Bearer {access_token}'}
-    response = requests.get('https://www.strava.com/api/v3/athlete', headers=headers)
-    
+    try:
+        access_token = refresh_access_token(user)
+    except strava_client.StravaAPIError as e:
+        logger.error("Error refreshing access token of user %s: %s", user.id, e)
+        return
+    # Runs on the authorization callback's request thread, so don't wait for the rate limit
+    try:
+        response = strava_client.get_athlete(access_token, wait=False)
+    except strava_client.RateLimitExceeded as e:
+        logger.error("Athlete summary of user %s not fetched: %s", user.id, e)
+        return
+
     if response.status_code == 200:
         athlete_summary = response.json()
         update_user_info(user, athlete_summary)
     else:
-        print("Error fetching athlete summary:", response.text)
+        logger.error("Error fetching athlete summary: %s", response.text)
 
 def update_user_info(user, athlete_summary):
     # Check if the name has changed
     if user.name != athlete_summary.get('firstname'):
         user.name = athlete_summary.get('firstname')
-        print("User's name updated:", user.name)
+        logger.info("User's name updated: %s", user.name)
 
     # Extract list of shoes and their IDs and names
     shoes = athlete_summary.get('shoes', [])
@@ -383,31 +474,41 @@ def update_user_info(user, athlete_summary):
     shoe_data = [{'id': shoe['id'], 'name': shoe['name']} for shoe in shoes]
 
     # Check if shoe data has changed
-    if user.shoes != json.dumps(shoe_data):
+    shoes_changed = user.shoes != json.dumps(shoe_data)
+    if shoes_changed:
         user.shoes = json.dumps(shoe_data)
-        print("User's shoe data updated:", user.shoes)
+        replace_shoes(user.athlete_id, shoe_data)
+        logger.info("User's shoe data updated: %s", user.shoes)
+        # Shoe names are drawn on every plot and named in the trends
+        bump_data_version(user.athlete_id)
+        invalidate_cached_stats(user.athlete_id)
 
     # Commit changes to the database
     db.session.commit()
 
-@app.route('/users')
+    if shoes_changed:
+        invalidate_shoe_mapping(user.athlete_id)
+
+@bp.route('/metrics/strava')
+def strava_metrics():
+    # Current use of the app-wide Strava request budget
+    return jsonify(strava_client.rate_limiter.metrics())
+
+@bp.route('/users')
 def list_users():
-    users = User.query.all()
-    user_data = []
-    for user in users:
-        user_data.append({
-            'id': user.id,
-            'name': user.name,
-            'athlete_id': user.athlete_id,
-            'access_token': user.access_token,
-            'refresh_token': user.refresh_token,
-            'expires_at': user.expires_at,
-            'scope': user.scope,
-            'shoes': user.shoes
-        })
-    return jsonify(user_data)
-
-@app.route('/authorization/success/<int:user_id>')
+    query = db.select(
+        User.id,
+        User.name,
+        User.athlete_id,
+        User.access_token,
+        User.refresh_token,
+        User.expires_at,
+        User.scope,
+        User.shoes
+    )
+    return list_rows(query, User.id)
+
+@bp.route('/authorization/success/<int:user_id>')
 def authorization_success(user_id):
     
     # Fetch user from the database by user ID
@@ -423,100 +524,259 @@ def authorization_success(user_id):
     # Render the success template with user name and athlete ID
     return render_template('authorization_success.html', user_name=user_name, athlete_id=athlete_id, user_id=user_id)
 
-@app.route('/fetch_activities/<int:user_id>')
+@bp.route('/fetch_activities/<int:user_id>')
 def fetch_activities(user_id):
    # Fetch user from the database by user ID
     user = User.query.get(user_id)
     if user is None:
         abort(404, "User not found")
-    
-    # Trigger fetching and storing of activities
-    fetch_and_store_activities(user)
 
-    # Return a response
-    return jsonify({"message": "Activities fetched and stored successfully!"})
+    # Only activities newer than the last sync are fetched unless ?full=1 is passed
+    full = request.args.get('full', '0').lower() in ('1', 'true', 'yes')
 
-def fetch_and_store_activities(user):
-    access_token = user.access_token
-    headers = {'Authorization': f'Bearer {access_token}'}
+    # Queue the fetching and storing of activities. A sync already pending for this user is reused, a
+    # full sync asked for while an incremental one runs is queued to run after it
+    job = sync_queue.enqueue(user.id, full=full)
+
+    # Return the job right away, its progress is reported by /sync_jobs/<job_id>
+    response = job.to_dict()
+    response['status_url'] = url_for('.sync_job_status', job_id=job.id)
+    return jsonify(response), 202
+
+@bp.route('/sync_jobs/<int:job_id>')
+def sync_job_status(job_id):
+    job = sync_queue.get(job_id)
+    if job is None:
+        abort(404, "Sync job not found")
+    return jsonify(job.to_dict())
+
+def run_sync_job(job):
+    # Runs on a sync worker thread inside an app context
+    user = User.query.get(job.user_id)
+    if user is None:
+        raise ValueError(f"User {job.user_id} not found")
+    fetch_and_store_activities(user, full=job.full, progress=job.progress)
+
+def activity_start_timestamp(activity):
+    # Strava start dates are UTC, e.g. '2024-04-01T07:30:00Z'
+    start_date = datetime.strptime(activity.get('start_date'), '%Y-%m-%dT%H:%M:%SZ')
+    return int(start_date.replace(tzinfo=timezone.utc).timestamp())
+
+@timed('sync.fetch_and_store_activities')
+def fetch_and_store_activities(user, full=False, progress=None):
+    # Raises strava_client.StravaAPIError if a page can't be fetched, the high-water mark is
+    # then left untouched so the next sync retries the missing pages
+    access_token = refresh_access_token(user)
     before = int(datetime.now().timestamp())  # Set 'before' parameter to current time
-    after = 0  # Set 'after' parameter to 0 to get all activities
-    page = 1
+    # Resume from the newest activity we already have, or start from 0 to get all activities
+    after = 0 if full or not user.last_synced_at else user.last_synced_at
     per_page = 200  # Set per_page to 200 for custom page size
+    newest = after
+    pages_fetched = 0
+    rows_upserted = 0
+    stored = []  # Activities written to the database, appended to the Parquet dataset afterwards
 
-    while True:
-        params = {'before': before, 'after': after, 'page': page, 'per_page': per_page}
-        response = requests.get('https://www.strava.com/api/v3/athlete/activities', headers=headers, params=params)
-        
-        if response.status_code == 200:
-            activities = response.json()
-            if not activities:  # If no activities returned, break the loop
-                break
-            
+    # Pages are downloaded concurrently while earlier ones are written to the database
+    try:
+        for page, activities in strava_client.iter_activity_pages(access_token, after=after, before=before, per_page=per_page):
             # Process and store activities in the database
-            store_activities_in_database(user, activities)
-            
-            # Increment page number for next request
-            page += 1
-        else:
-            print("Error fetching activities:", response.text)
-            break
+            rows_upserted += store_activities_in_database(user, activities)
+            stored.extend(activities)
+            newest = max([newest] + [activity_start_timestamp(activity) for activity in activities])
+            pages_fetched += 1
+            if progress:
+                progress(pages_fetched, rows_upserted)
+    finally:
+        # Pages stored before a failed page are exported too
+        export_activities(user.athlete_id, stored)
+
+    # Only move the high-water mark once every page has been stored
+    if newest != user.last_synced_at:
+        user.last_synced_at = newest
+        db.session.commit()
+
+def activity_row(athlete_id, activity):
+    # Map a Strava activity JSON onto the columns of the Activity table
+    return {
+        'athlete_id': athlete_id,
+        'activity_id': activity.get('id'),
+        'activity_date': datetime.strptime(activity.get('start_date'), '%Y-%m-%dT%H:%M:%SZ'),
+        'activity_type': activity.get('type'),
+        'elapsed_time': activity.get('elapsed_time'),
+        'moving_time': activity.get('moving_time'),
+        'distance': activity.get('distance'),
+        'average_speed': activity.get('average_speed'),
+        'gear_id': activity.get('gear_id'),
+        # Pace is not provided in the activity JSON, it's computed for the whole page on ingest
+        'pace': None
+    }
+
+def activity_rows(athlete_id, activities):
+    # activity_row() of every activity by activity ID, the last occurrence of a duplicate wins
+    rows = {}
+    for activity in activities:
+        row = activity_row(athlete_id, activity)
+        rows[row['activity_id']] = row
+
+    # Seconds per kilometer from the average speed, for every activity at once
+    for row, pace in zip(rows.values(), run_paces([row['average_speed'] for row in rows.values()])):
+        row['pace'] = pace
+    return rows
 
+@timed('sync.store_activities_in_database')
 def store_activities_in_database(user, activities):
-    for activity in activities:
-        # Extract relevant data from the activity JSON
-        activity_id = activity.get('id')
-        existing_activity = Activity.query.filter_by(athlete_id=user.athlete_id, activity_id=activity_id).first()
-
-        if existing_activity:
-            # Update existing activity
-            existing_activity.activity_date = datetime.strptime(activity.get('start_date'), '%Y-%m-%dT%H:%M:%SZ')
-            existing_activity.activity_type = activity.get('type')
-            existing_activity.elapsed_time = activity.get('elapsed_time')
-            existing_activity.moving_time = activity.get('moving_time')
-            existing_activity.distance = activity.get('distance')
-            existing_activity.average_speed = activity.get('average_speed')
-            existing_activity.gear_id = activity.get('gear_id')
-            # Assuming pace is not provided in the activity JSON
-            existing_activity.pace = None  
-        else:
-            # Create a new activity object and store it in the database
-            new_activity = Activity(
-                athlete_id=user.athlete_id,
-                activity_id=activity_id,
-                activity_date=datetime.strptime(activity.get('start_date'), '%Y-%m-%dT%H:%M:%SZ'),
-                activity_type=activity.get('type'),
-                elapsed_time=activity.get('elapsed_time'),
-                moving_time=activity.get('moving_time'),
-                distance=activity.get('distance'),
-                average_speed=activity.get('average_speed'),
-                gear_id=activity.get('gear_id'),
-                pace=None  
+    # Returns the number of rows inserted or updated
+    if not activities:
+        return 0
+
+    rows = activity_rows(user.athlete_id, activities)
+
+    # Look up which of these activities are already stored with a single query, along with the
+    # values they currently contribute to the per-shoe totals
+    existing = {
+        stored['activity_id']: stored for stored in db.session.execute(
+            db.select(
+                Activity.activity_id,
+                Activity.id,
+                Activity.activity_type,
+                Activity.gear_id,
+                Activity.distance,
+                Activity.average_speed
+            ).where(
+                Activity.athlete_id == user.athlete_id,
+                Activity.activity_id.in_(list(rows))
             )
-            db.session.add(new_activity)
+        ).mappings()
+    }
+
+    new_rows = []
+    updated_rows = []
+    for activity_id, row in rows.items():
+        if activity_id in existing:
+            # Bulk UPDATE by primary key
+            updated_rows.append(dict(row, id=existing[activity_id]['id']))
+        else:
+            new_rows.append(row)
+
+    # Write the whole page with one executemany per statement
+    if new_rows:
+        db.session.execute(db.insert(Activity), new_rows)
+    if updated_rows:
+        db.session.execute(db.update(Activity), updated_rows)
+
+    # Keep the per-shoe totals in step, in the same transaction
+    apply_run_changes(user.athlete_id, existing.values(), rows.values())
+    bump_data_version(user.athlete_id)
 
     db.session.commit()
 
-@app.route('/activities')
+    # The cached plots and trends of this athlete are out of date now
+    invalidate_cached_stats(user.athlete_id)
+    return len(rows)
+
+@timed('sync.export_activities')
+def export_activities(athlete_id, activities):
+    # Append synced activities to the Parquet dataset of columnar.py when COLUMNAR_DIR is set. A
+    # failed export doesn't fail the sync, `flask export-activities` rebuilds the dataset.
+    # COLUMNAR_DIR is checked before importing columnar.py, so syncs don't import pyarrow without it.
+    if not activities or not os.getenv('COLUMNAR_DIR'):
+        return
+    try:
+        import columnar
+        columnar.append_activities(athlete_id, list(activity_rows(athlete_id, activities).values()))
+    except Exception:
+        logger.exception("Exporting activities of athlete %s to Parquet failed", athlete_id)
+    # Plots and trends drawn from the dataset during the sync are out of date
+    bump_data_version(athlete_id)
+    db.session.commit()
+    invalidate_cached_stats(athlete_id)
+
+@bp.cli.command('export-activities')
+@click.option('--athlete-id', type=int, default=None, help='Only export the activities of this athlete.')
+def export_activities_command(athlete_id):
+    """Rewrite the Parquet dataset in COLUMNAR_DIR from the stored activities."""
+    import columnar
+
+    if not columnar.enabled():
+        raise click.ClickException("Set COLUMNAR_DIR to the directory of the Parquet dataset.")
+    if athlete_id is None:
+        athlete_ids = db.session.execute(db.select(Activity.athlete_id).distinct()).scalars().all()
+    else:
+        athlete_ids = [athlete_id]
+
+    columns = [getattr(Activity, name) for name in columnar.SCHEMA.names]
+    for exported_athlete_id in athlete_ids:
+        rows = db.session.execute(db.select(*columns).where(Activity.athlete_id == exported_athlete_id)).mappings()
+        columnar.replace_activities(exported_athlete_id, [dict(row) for row in rows])
+        bump_data_version(exported_athlete_id)
+        db.session.commit()
+        invalidate_cached_stats(exported_athlete_id)
+    click.echo(f"Exported the activities of {len(athlete_ids)} athletes.")
+
+@bp.cli.command('rebuild-shoe-stats')
+@click.option('--athlete-id', type=int, default=None, help='Only rebuild the totals of this athlete.')
+def rebuild_shoe_stats_command(athlete_id):
+    """Recompute the per-shoe totals from the stored activities and shoes."""
+    users = User.query.all() if athlete_id is None else User.query.filter_by(athlete_id=athlete_id).all()
+    backfill_gear(users)
+    backfill_paces(athlete_id)
+    rebuild_shoe_stats(athlete_id)
+    for user in users:
+        bump_data_version(user.athlete_id)
+    db.session.commit()
+    click.echo("Shoe stats rebuilt.")
+
+@bp.route('/activities')
 def list_activities():
-    activities = Activity.query.all()
-    activity_data = []
-    for activity in activities:
-        activity_data.append({
-            'id': activity.id,
-            'athlete_id': activity.athlete_id,
-            'activity_id': activity.activity_id,
-            'activity_date': activity.activity_date,
-            'activity_type': activity.activity_type,
-            'elapsed_time': activity.elapsed_time,
-            'moving_time': activity.moving_time,
-            'distance': activity.distance,
-            'average_speed': activity.average_speed
-        })
-    return jsonify(activity_data)
+    query = db.select(
+        Activity.id,
+        Activity.athlete_id,
+        Activity.activity_id,
+        Activity.activity_date,
+        Activity.activity_type,
+        Activity.elapsed_time,
+        Activity.moving_time,
+        Activity.distance,
+        Activity.average_speed
+    )
+    # ?athlete_id= uses the (athlete_id, id) index for both the filter and the page order
+    athlete_id = request.args.get('athlete_id', type=int)
+    if athlete_id is not None:
+        query = query.where(Activity.athlete_id == athlete_id)
+    return list_rows(query, Activity.id)
+
+def list_rows(query, id_column):
+    # Keyset pagination over id_column: ?after_id=<last id seen>&limit=<page size>. A JSON page is
+    # an array with a Link header pointing at the next page; ?format=ndjson streams every row after
+    # after_id (up to limit, if given) from a server-side cursor, one JSON object per line.
+    after_id = request.args.get('after_id', type=int)
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit <= 0:
+        abort(400, "limit must be positive")
+
+    if after_id is not None:
+        query = query.where(id_column > after_id)
+    query = query.order_by(id_column)
+
+    if request.args.get('format') == 'ndjson':
+        if limit is not None:
+            query = query.limit(limit)
+
+        def generate():
+            rows = db.session.execute(query.execution_options(yield_per=STREAM_BATCH_SIZE)).mappings()
+            for row in rows:
+                yield current_app.json.dumps(dict(row)) + '\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    limit = min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+    rows = [dict(row) for row in db.session.execute(query.limit(limit)).mappings()]
+    response = jsonify(rows)
+    if len(rows) == limit:
+        args = request.args.to_dict()
+        args.update(after_id=rows[-1]['id'], limit=limit)
+        response.headers['Link'] = f'<{url_for(request.endpoint, **args)}>; rel="next"'
+    return response
 
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
-    app.run(debug=True)
-
+    create_app().run(debug=True)
@@ -0,0 +1,78 @@
+"""Measure how long a fresh process takes to import the app and serve its first request.
+
+Runs python -X importtime in a new interpreter for each measurement. Run from the repository root:
+
+    python benchmarks/bench_cold_start.py --runs 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Times the factory and the first request after the import, printed as 'name seconds' lines
+FIRST_REQUEST = '''
+import sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app()
+created = time.perf_counter()
+response = flask_app.test_client().get('/')
+served = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print('import', imported - start)
+print('create_app', created - imported)
+print('first_request', served - created)
+print('heavy_modules', ','.join(m for m in ('pandas', 'numpy', 'matplotlib', 'alembic') if m in sys.modules) or '-')
+'''
+
+def parse_importtime(stderr):
+    # 'import time: self [us] | cumulative | imported package' lines -> {module: cumulative seconds}
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        cumulative[name.strip()] = int(cumulative_us) / 1e6
+    return cumulative
+
+def measure(database):
+    env = dict(os.environ, DATABASE_URL=database, LOG_LEVEL='WARNING')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', FIRST_REQUEST], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    timings = {}
+    for line in result.stdout.splitlines():
+        name, value = line.split()
+        timings[name] = value if name == 'heavy_modules' else float(value)
+    return timings, parse_importtime(result.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='Slowest top-level imports to list')
+    args = parser.parse_args()
+
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        database = f'sqlite:///{os.path.join(tmp, "cold_start.db")}'
+        for _ in range(args.runs):
+            runs.append(measure(database))
+
+    # -X importtime itself slows imports down, so compare these numbers with each other only
+    for name in ('import', 'create_app', 'first_request'):
+        print(f"{name:>14}: median {statistics.median(timings[name] for timings, _ in runs) * 1000:7.0f} ms")
+    print(f"{'loaded':>14}: {runs[-1][0]['heavy_modules']}")
+
+    _, cumulative = runs[-1]
+    print("\nSlowest imports of the last run (cumulative, top-level packages outside the standard library):")
+    slowest = sorted(((seconds, name) for name, seconds in cumulative.items()
+                      if name not in sys.stdlib_module_names and '.' not in name), reverse=True)
+    for seconds, name in slowest[:args.top]:
+        print(f"{seconds * 1000:8.0f} ms  {name}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Compare the per-row and bulk ingest paths of store_activities_in_database.
+
+Run from the repository root:
+
+    python benchmarks/bench_ingest.py --activities 10000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from models import db, User, Activity
+import app as shoe_app
+from synthetic import make_activities, make_shoes
+
+PAGE_SIZE = 200  # Strava's maximum per_page
+
+def legacy_store_activities_in_database(user, activities):
+    # The original implementation: one SELECT per activity, then per-object writes
+    for activity in activities:
+        activity_id = activity.get('id')
+        existing_activity = Activity.query.filter_by(athlete_id=user.athlete_id, activity_id=activity_id).first()
+        row = shoe_app.activity_row(user.athlete_id, activity)
+        if existing_activity:
+            for key, value in row.items():
+                setattr(existing_activity, key, value)
+        else:
+            db.session.add(Activity(**row))
+    db.session.commit()
+
+def run(store, activities, db_path):
+    bench_app = Flask(__name__)
+    bench_app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    db.init_app(bench_app)
+    with bench_app.app_context():
+        db.create_all()
+        user = User(athlete_id=1)
+        db.session.add(user)
+        db.session.commit()
+
+        results = {}
+        # First pass inserts everything, second pass updates every row
+        for label in ('insert', 'update'):
+            start = time.perf_counter()
+            for i in range(0, len(activities), PAGE_SIZE):
+                store(user, activities[i:i + PAGE_SIZE])
+            elapsed = time.perf_counter() - start
+            results[label] = len(activities) / elapsed
+        db.session.remove()
+        db.engine.dispose()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--activities', type=int, default=10000)
+    args = parser.parse_args()
+
+    activities = make_activities(args.activities, make_shoes(1, 5))
+    with tempfile.TemporaryDirectory() as tmp:
+        before = run(legacy_store_activities_in_database, activities, os.path.join(tmp, 'before.db'))
+        after = run(shoe_app.store_activities_in_database, activities, os.path.join(tmp, 'after.db'))
+
+    print(f"{args.activities} activities, {PAGE_SIZE} per page")
+    for label in ('insert', 'update'):
+        print(f"{label:>6}: before {before[label]:10.0f} rows/s   after {after[label]:10.0f} rows/s"
+              f"   ({after[label] / before[label]:.1f}x)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Compare loading runs through ORM objects with the columnar load_runs path.
+
+Run from the repository root:
+
+    python benchmarks/bench_load_runs.py --rows 1000 10000 100000
+"""
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from flask import Flask
+from models import db, User, Activity
+import app as shoe_app
+import stats
+from synthetic import make_activities, make_shoes
+
+def legacy_load_runs(athlete_id, shoe_mapping):
+    # The original path: full ORM instances copied field by field into dicts
+    activities = Activity.query.filter_by(athlete_id=athlete_id, activity_type='Run').all()
+    activity_data = []
+    for activity in activities:
+        activity_data.append({
+            'athlete_id': activity.athlete_id,
+            'activity_id': activity.activity_id,
+            'activity_date': activity.activity_date,
+            'activity_type': activity.activity_type,
+            'elapsed_time': activity.elapsed_time,
+            'moving_time': activity.moving_time,
+            'distance': activity.distance,
+            'average_speed': activity.average_speed,
+            'gear_id': activity.gear_id,
+            'pace': activity.pace
+        })
+    df = pd.DataFrame(activity_data)
+    df.loc[:, 'distance'] = pd.to_numeric(df['distance'], errors='coerce')
+    df.loc[:, 'pace'] = 1 / df['average_speed'] * 1000
+    df.loc[:, 'pace'] = df['pace'].astype(int)
+    df['gear_id'] = df['gear_id'].map(shoe_mapping)
+    return df
+
+def measure(load, athlete_id, shoe_mapping):
+    db.session.expunge_all()
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    df = load(athlete_id, shoe_mapping)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    db.session.rollback()
+    return len(df), elapsed, peak
+
+def run(rows, db_path):
+    bench_app = Flask(__name__)
+    bench_app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    db.init_app(bench_app)
+    with bench_app.app_context():
+        db.create_all()
+        shoes = make_shoes(1, 5)
+        user = User(athlete_id=1)
+        db.session.add(user)
+        db.session.commit()
+
+        # Only runs with a speed, the legacy path can't convert a zero speed to a pace
+        activities = [activity for activity in make_activities(rows, shoes) if activity['average_speed'] > 0]
+        for activity in activities:
+            activity['type'] = 'Run'
+        for i in range(0, len(activities), 5000):
+            shoe_app.store_activities_in_database(user, activities[i:i + 5000])
+
+        shoe_mapping = {shoe['id']: shoe['name'] for shoe in shoes}
+        results = {
+            'orm': measure(legacy_load_runs, 1, shoe_mapping),
+            'columnar': measure(stats.load_runs, 1, shoe_mapping)
+        }
+        db.session.remove()
+        db.engine.dispose()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'path':>9} {'time (ms)':>10} {'peak (MiB)':>11}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            results = run(rows, os.path.join(tmp, f'runs_{rows}.db'))
+            for label, (count, elapsed, peak) in results.items():
+                print(f"{count:>8} {label:>9} {elapsed * 1000:>10.1f} {peak / 2 ** 20:>11.2f}")
+
+if __name__ == '__main__':
+    main()
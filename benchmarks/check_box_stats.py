@@ -0,0 +1,126 @@
+"""Check the box plot statistics drawn from pace histograms against exact statistics over every run.
+
+Stores synthetic activities through store_activities_in_database, then stores a share of them
+again with a different speed, shoe or type, so the histograms have runs moved out of their bins
+as well as into them. Compares stats.box_plot_stats with matplotlib.cbook.boxplot_stats over the
+paces of the stored runs, per shoe. Exits with status 1 if any statistic or run count differs.
+Run from the repository root:
+
+    python benchmarks/check_box_stats.py --runs 1000 10000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import make_activities, make_shoes
+
+PAGE_SIZE = 200  # Strava's maximum per_page
+STATS = ('q1', 'med', 'q3', 'whislo', 'whishi', 'mean')
+TOLERANCE = 1e-9  # Only floating point noise between the weighted and the plain mean
+
+def changed_activities(activities, shoes, rng, share=0.2):
+    # Copies of a share of the activities as Strava would return them after an edit
+    changed = []
+    for activity in rng.sample(activities, int(len(activities) * share)):
+        activity = dict(activity)
+        change = rng.randrange(4)
+        if change == 0:
+            activity['average_speed'] = round(rng.uniform(2.5, 4.2), 3)
+        elif change == 1:
+            activity['gear_id'] = rng.choice(shoes)['id']
+        elif change == 2:
+            activity['type'] = 'Ride' if activity['type'] == 'Run' else 'Run'
+        else:
+            activity['average_speed'] = 0.0
+        changed.append(activity)
+    return changed
+
+def store(shoe_app, user, activities):
+    for i in range(0, len(activities), PAGE_SIZE):
+        shoe_app.store_activities_in_database(user, activities[i:i + PAGE_SIZE])
+
+def check(shoe_app, athlete_id, runs, seed):
+    import stats
+    from matplotlib import cbook
+    from models import db, Activity, PaceHistogram, User
+
+    shoes = make_shoes(athlete_id, 4)
+    user = User(athlete_id=athlete_id, name='Bench', shoes='[]')
+    db.session.add(user)
+    db.session.commit()
+    shoe_app.update_user_info(user, {'firstname': 'Bench', 'shoes': shoes})
+
+    activities = make_activities(runs, shoes, seed=seed, start_id=athlete_id * 10_000_000)
+    store(shoe_app, user, activities)
+    store(shoe_app, user, changed_activities(activities, shoes, random.Random(seed)))
+
+    shoe_mapping = shoe_app.get_shoe_mapping(athlete_id)
+    start = time.perf_counter()
+    estimates = {box['label']: box for box in stats.box_plot_stats(athlete_id, shoe_mapping)}
+    histogram_ms = (time.perf_counter() - start) * 1000
+    histogram_runs = dict(db.session.execute(
+        db.select(PaceHistogram.gear_id, db.func.sum(PaceHistogram.runs))
+        .where(PaceHistogram.athlete_id == athlete_id)
+        .group_by(PaceHistogram.gear_id)
+    ).all())
+
+    start = time.perf_counter()
+    paces = {}
+    for gear_id, pace in db.session.execute(
+        db.select(Activity.gear_id, Activity.pace).where(
+            Activity.athlete_id == athlete_id,
+            Activity.activity_type == 'Run',
+            Activity.pace.is_not(None)
+        )
+    ):
+        paces.setdefault(gear_id, []).append(pace)
+    exact = {shoe_mapping[gear_id]: cbook.boxplot_stats(values)[0]
+             for gear_id, values in paces.items() if gear_id in shoe_mapping}
+    exact_ms = (time.perf_counter() - start) * 1000
+
+    errors = []
+    if set(exact) != set(estimates):
+        errors.append(f"shoes {sorted(estimates)} instead of {sorted(exact)}")
+    for gear_id, values in paces.items():
+        if histogram_runs.get(gear_id or '', 0) != len(values):
+            errors.append(f"{histogram_runs.get(gear_id or '', 0)} runs of {gear_id} in the histogram, {len(values)} stored")
+    error = 0.0
+    for shoe in set(exact) & set(estimates):
+        error = max([error] + [abs(float(exact[shoe][stat]) - float(estimates[shoe][stat])) for stat in STATS])
+    if error > TOLERANCE:
+        errors.append(f"max abs error {error:.2e} s/km")
+    return errors, error, len(exact), exact_ms, histogram_ms
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(tmp, "box_stats.db")}'
+        os.environ['PLOT_CACHE_DIR'] = os.path.join(tmp, 'plot_cache')
+        os.environ['PLOT_WORKERS'] = '0'
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+        import app as shoe_app
+        flask_app = shoe_app.create_app()
+
+        failed = 0
+        print(f"{'activities':>10} {'shoes':>5} {'exact (ms)':>11} {'histogram (ms)':>15} {'max abs error (s/km)':>21}")
+        with flask_app.app_context():
+            for athlete_id, runs in enumerate(args.runs, start=1):
+                errors, error, shoes, exact_ms, histogram_ms = check(shoe_app, athlete_id, runs, args.seed)
+                failed += bool(errors)
+                print(f"{runs:>10} {shoes:>5} {exact_ms:>11.2f} {histogram_ms:>15.2f} {error:>21.2e}"
+                      f"{'  FAILED: ' + '; '.join(errors) if errors else ''}")
+            shoe_app.db.engine.dispose()
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Run ingest and stats reads against one SQLite database at the same time and count lock errors.
+
+Writer threads keep upserting pages of activities through store_activities_in_database while
+reader threads compute the stats page tables, like the sync workers and request threads of one
+gunicorn worker. Exits with status 1 if any operation failed with "database is locked".
+
+Run from the repository root:
+
+    python benchmarks/check_sqlite_concurrency.py --writers 2 --readers 8 --duration 20
+
+and compare with the SQLite defaults the app used before:
+
+    SQLITE_JOURNAL_MODE=delete SQLITE_SYNCHRONOUS=full SQLITE_BUSY_TIMEOUT=0 \\
+        python benchmarks/check_sqlite_concurrency.py --writers 2 --readers 8 --duration 20
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.exc import OperationalError
+
+import app as shoe_app
+import stats
+from models import db, User
+from synthetic import make_activities, make_shoes
+
+PAGE_SIZE = 200  # Strava's maximum per_page
+
+class Counters:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ok = {'write': 0, 'read': 0}
+        self.locked = {'write': 0, 'read': 0}
+        self.other_errors = []
+        self.slowest = {'write': 0.0, 'read': 0.0}
+
+    def record(self, kind, seconds, error=None):
+        with self.lock:
+            if error is None:
+                self.ok[kind] += 1
+                self.slowest[kind] = max(self.slowest[kind], seconds)
+            elif 'database is locked' in str(error):
+                self.locked[kind] += 1
+            else:
+                self.other_errors.append(f'{kind}: {error}')
+
+def writer(flask_app, athlete_id, activities, deadline, counters):
+    # Upserts the athlete's activities page by page, over and over, like repeated full syncs
+    with flask_app.app_context():
+        user = User.query.filter_by(athlete_id=athlete_id).one()
+        page = 0
+        while time.monotonic() < deadline:
+            rows = activities[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+            page = (page + 1) % max(1, len(activities) // PAGE_SIZE)
+            start = time.perf_counter()
+            try:
+                shoe_app.store_activities_in_database(user, rows)
+                counters.record('write', time.perf_counter() - start)
+            except OperationalError as e:
+                db.session.rollback()
+                counters.record('write', time.perf_counter() - start, e)
+
+def reader(flask_app, athletes, deadline, counters):
+    # The database work of a stats page that has to render its plots
+    with flask_app.app_context():
+        athlete_id = 0
+        while time.monotonic() < deadline:
+            athlete_id = athlete_id % athletes + 1
+            start = time.perf_counter()
+            try:
+                shoe_mapping = shoe_app.get_shoe_mapping(athlete_id)
+                stats.shoe_stats_table(athlete_id, shoe_mapping)
+                stats.box_plot_stats(athlete_id, shoe_mapping)
+                stats.load_runs(athlete_id, shoe_mapping)
+                shoe_app.plot_fingerprint(athlete_id)
+                db.session.commit()
+                counters.record('read', time.perf_counter() - start)
+            except OperationalError as e:
+                db.session.rollback()
+                counters.record('read', time.perf_counter() - start, e)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, default=2, help='Ingest threads, one athlete each')
+    parser.add_argument('--readers', type=int, default=8, help='Stats threads')
+    parser.add_argument('--activities', type=int, default=2000, help='Activities per athlete')
+    parser.add_argument('--duration', type=float, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(tmp, "concurrency.db")}'
+        flask_app = shoe_app.create_app()
+
+        activities = {}
+        with flask_app.app_context():
+            for athlete_id in range(1, args.writers + 1):
+                shoes = make_shoes(athlete_id, 5)
+                user = User(athlete_id=athlete_id)
+                db.session.add(user)
+                shoe_app.replace_shoes(athlete_id, shoes)
+                db.session.commit()
+                activities[athlete_id] = make_activities(args.activities, shoes, seed=athlete_id,
+                                                         start_id=athlete_id * 10_000_000)
+                for i in range(0, args.activities, PAGE_SIZE):
+                    shoe_app.store_activities_in_database(user, activities[athlete_id][i:i + PAGE_SIZE])
+            journal_mode = db.session.execute(db.text('PRAGMA journal_mode')).scalar()
+
+        counters = Counters()
+        deadline = time.monotonic() + args.duration
+        threads = [threading.Thread(target=writer, args=(flask_app, athlete_id, rows, deadline, counters))
+                   for athlete_id, rows in activities.items()]
+        threads += [threading.Thread(target=reader, args=(flask_app, args.writers, deadline, counters))
+                    for _ in range(args.readers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with flask_app.app_context():
+            db.engine.dispose()
+
+    print(f"journal_mode={journal_mode}, {args.writers} writers, {args.readers} readers, {args.duration:.0f}s")
+    for kind in ('write', 'read'):
+        print(f"{kind:>6}: {counters.ok[kind]:6} ok   {counters.locked[kind]:6} 'database is locked'"
+              f"   slowest {counters.slowest[kind] * 1000:7.0f} ms")
+    for error in counters.other_errors[:5]:
+        print("Other error:", error)
+
+    failed = sum(counters.locked.values()) + len(counters.other_errors)
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
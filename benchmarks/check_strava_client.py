@@ -0,0 +1,248 @@
+"""Check strava_client's retries and rate limiting against the stub Strava server.
+
+Injects 503s and 429s and runs the 15 minute and daily budgets out, with a fake clock shared by
+the stub and the client's RateLimiter so waiting for a window to reset takes no time. Checks
+how often requests are retried, that POSTs are not resent after Strava answered or the connection
+dropped once the request was sent, that the client
+waits for the next window instead of running into 429s, that a spent daily budget stops requests
+before they are sent, and that the authorization callback fails fast. Exits with status 1 if any
+check fails. Run from the repository root:
+
+    python benchmarks/check_strava_client.py
+"""
+import os
+import socket
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+import strava_client
+from stub_strava import StubStrava
+
+TOKEN = 'bench-1'  # Maps to athlete 1 on the stub
+
+class FakeClock:
+    # Shared by the stub and the RateLimiter; sleeping moves it forward instead of waiting
+    def __init__(self, now):
+        self.now = now
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+def setup(rate_limit=(100000, 1000000)):
+    # A new stub, limiter and clock for one check, 100 seconds into a 15 minute window
+    clock = FakeClock(1_700_000_200.0)
+    stub = StubStrava(activities=10, shoes=2, rate_limit=rate_limit, clock=clock).start()
+    strava_client.STRAVA_API_URL = f'{stub.url}/api/v3'
+    strava_client.STRAVA_OAUTH_URL = f'{stub.url}/oauth'
+    strava_client.rate_limiter = strava_client.RateLimiter(clock=clock, sleep=clock.sleep)
+    return stub, clock
+
+def athlete_requests(stub):
+    return stub.requests_by_path.get('/api/v3/athlete', 0)
+
+def token_requests(stub):
+    return stub.requests_by_path.get('/oauth/token', 0)
+
+def exchange_code():
+    return strava_client.post(f'{strava_client.STRAVA_OAUTH_URL}/token', data={'code': 'single-use'})
+
+def check_get_retried():
+    stub, _ = setup()
+    stub.inject(503, 503)
+    response = strava_client.get_athlete(TOKEN)
+    stub.stop()
+    return (response.status_code == 200 and athlete_requests(stub) == 3
+            and strava_client.rate_limiter.retries == 2), f'{response.status_code} after {athlete_requests(stub)} requests'
+
+def check_get_gives_up():
+    stub, _ = setup()
+    stub.inject(*[503] * (strava_client.MAX_RETRIES + 1))
+    response = strava_client.get_athlete(TOKEN)
+    stub.stop()
+    return (response.status_code == 503 and athlete_requests(stub) == strava_client.MAX_RETRIES + 1,
+            f'{response.status_code} after {athlete_requests(stub)} requests')
+
+def check_post_not_resent():
+    stub, _ = setup()
+    stub.inject(503)
+    response = exchange_code()
+    stub.stop()
+    return response.status_code == 503 and token_requests(stub) == 1, f'{response.status_code} after {token_requests(stub)} requests'
+
+def check_post_retried_on_connection_error():
+    setup()
+    # A port nobody listens on, the connection is refused
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    try:
+        strava_client.post(f'http://127.0.0.1:{port}/oauth/token', data={'code': 'single-use'})
+        return False, 'no error raised'
+    except requests.ConnectionError:
+        attempts = strava_client.rate_limiter.requests
+        return attempts == strava_client.MAX_RETRIES + 1, f'{attempts} attempts'
+
+class DroppingServer:
+    # Reads each request in full, then closes the connection without answering, as when Strava
+    # processed a request but the connection broke before the response arrived
+    def __init__(self):
+        self.requests = 0
+        self._sock = socket.create_server(('127.0.0.1', 0))
+        self.url = 'http://127.0.0.1:%d' % self._sock.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            with conn:
+                data = b''
+                while b'\r\n\r\n' not in data:
+                    data += conn.recv(65536)
+                head, _, body = data.partition(b'\r\n\r\n')
+                length = next((int(line.split(b':')[1]) for line in head.split(b'\r\n')
+                               if line.lower().startswith(b'content-length:')), 0)
+                while len(body) < length:
+                    body += conn.recv(65536)
+                self.requests += 1
+
+    def stop(self):
+        self._sock.close()
+
+def check_post_not_resent_after_drop():
+    setup()
+    server = DroppingServer()
+    try:
+        strava_client.post(f'{server.url}/oauth/token', data={'code': 'single-use'})
+        return False, 'no error raised'
+    except requests.ConnectionError:
+        return server.requests == 1, f'{server.requests} requests reached the server'
+    finally:
+        server.stop()
+
+def check_get_resent_after_drop():
+    setup()
+    server = DroppingServer()
+    try:
+        strava_client.get(f'{server.url}/api/v3/athlete')
+        return False, 'no error raised'
+    except requests.ConnectionError:
+        return server.requests == strava_client.MAX_RETRIES + 1, f'{server.requests} requests reached the server'
+    finally:
+        server.stop()
+
+def check_waits_for_window():
+    stub, clock = setup(rate_limit=(3, 1000))
+    statuses = [strava_client.get_athlete(TOKEN).status_code for _ in range(5)]
+    stub.stop()
+    # The fourth request waits out the 800 seconds left in the window instead of getting a 429
+    return (statuses == [200] * 5 and clock.slept == [800.0] and athlete_requests(stub) == 5,
+            f'statuses {statuses}, slept {clock.slept}')
+
+def check_429_spends_window():
+    stub, clock = setup(rate_limit=(600, 30000))
+    strava_client.get_athlete(TOKEN)  # Learn the limits
+    stub.inject(429)
+    response = strava_client.get_athlete(TOKEN)
+    stub.stop()
+    return (response.status_code == 200 and clock.slept == [800.0] and athlete_requests(stub) == 3,
+            f'{response.status_code}, slept {clock.slept}')
+
+def check_daily_budget():
+    stub, clock = setup(rate_limit=(100, 5))
+    for _ in range(5):
+        strava_client.get_athlete(TOKEN)
+    try:
+        strava_client.get_athlete(TOKEN)
+        return False, 'no RateLimitExceeded raised'
+    except strava_client.RateLimitExceeded:
+        pass
+    finally:
+        stub.stop()
+    return athlete_requests(stub) == 5 and not clock.slept, f'{athlete_requests(stub)} requests sent'
+
+def check_request_thread_fails_fast():
+    stub, clock = setup(rate_limit=(2, 1000))
+    strava_client.get_athlete(TOKEN)
+    strava_client.get_athlete(TOKEN)
+    try:
+        strava_client.get_athlete(TOKEN, wait=False)
+        return False, 'no RateLimitExceeded raised'
+    except strava_client.RateLimitExceeded:
+        pass
+    finally:
+        stub.stop()
+    return athlete_requests(stub) == 2 and not clock.slept, f'{athlete_requests(stub)} requests, slept {clock.slept}'
+
+def check_request_thread_retries_capped():
+    stub, _ = setup()
+    stub.inject(*[503] * (strava_client.MAX_RETRIES + 1))
+    response = strava_client.get_athlete(TOKEN, wait=False)
+    stub.stop()
+    expected = min(strava_client.MAX_RETRIES, strava_client.INTERACTIVE_MAX_RETRIES) + 1
+    return (response.status_code == 503 and athlete_requests(stub) == expected,
+            f'{response.status_code} after {athlete_requests(stub)} requests')
+
+def check_authorization_callback(flask_app):
+    # A 503 from the token endpoint is not retried, a spent window answers 503 without waiting
+    stub, clock = setup(rate_limit=(2, 1000))
+    client = flask_app.test_client()
+    stub.inject(503)
+    failed = client.get('/authorization/callback?code=single-use')
+    sent = token_requests(stub)
+    strava_client.get_athlete(TOKEN)
+    strava_client.get_athlete(TOKEN)
+    limited = client.get('/authorization/callback?code=single-use')
+    stub.stop()
+    return (failed.status_code == 200 and sent == 1 and limited.status_code == 503
+            and token_requests(stub) == 1 and not clock.slept,
+            f'token requests {token_requests(stub)}, rate limited callback {limited.status_code}, slept {clock.slept}')
+
+def main():
+    strava_client.BACKOFF_BASE = 0.001  # Keep the jittered backoff between retries short
+
+    checks = [
+        ('GET retried after 503s', check_get_retried),
+        ('GET gives up after STRAVA_MAX_RETRIES', check_get_gives_up),
+        ('POST not resent after a 503', check_post_not_resent),
+        ('POST retried after connection errors', check_post_retried_on_connection_error),
+        ('POST not resent after the connection dropped', check_post_not_resent_after_drop),
+        ('GET resent after the connection dropped', check_get_resent_after_drop),
+        ('Waits for the 15 minute window to reset', check_waits_for_window),
+        ('A 429 spends the window', check_429_spends_window),
+        ('Spent daily budget stops requests', check_daily_budget),
+        ('Request threads fail fast', check_request_thread_fails_fast),
+        ('Request threads retry less', check_request_thread_retries_capped),
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(tmp, "strava_client.db")}'
+        os.environ['PLOT_WORKERS'] = '0'
+        import app as shoe_app
+        flask_app = shoe_app.create_app()
+        checks.append(('Authorization callback', lambda: check_authorization_callback(flask_app)))
+
+        failed = 0
+        for name, check in checks:
+            ok, detail = check()
+            failed += not ok
+            print(f"{'ok' if ok else 'FAILED':>6}  {name}: {detail}")
+        with flask_app.app_context():
+            shoe_app.db.engine.dispose()
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
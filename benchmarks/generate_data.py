@@ -0,0 +1,73 @@
+"""Fill a database with synthetic athletes, shoes and activities for load testing.
+
+Run from the repository root, pointing at a scratch database rather than app.db:
+
+    python benchmarks/generate_data.py --database sqlite:////tmp/bench.db --athletes 50 --activities 2000 --shoes 5
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as shoe_app
+from models import db, User
+from synthetic import make_activities, make_shoes
+
+PAGE_SIZE = 200  # Strava's maximum per_page
+
+def athlete_activities(athlete_id, activities, shoes):
+    # The same activities for an athlete every time, so the stub Strava server can serve them too
+    return make_activities(activities, make_shoes(athlete_id, shoes), seed=athlete_id,
+                           start_id=athlete_id * 10_000_000)
+
+def bench_token(athlete_id):
+    # Access and refresh token of a generated user, the stub Strava server maps it back to the athlete
+    return f'bench-{athlete_id}'
+
+def populate(athletes, activities, shoes):
+    # Must run inside an app context
+    db.create_all()
+    for athlete_id in range(1, athletes + 1):
+        user = User.query.filter_by(athlete_id=athlete_id).first()
+        if user is None:
+            user = User(athlete_id=athlete_id)
+            db.session.add(user)
+        shoe_data = make_shoes(athlete_id, shoes)
+        user.name = f'Athlete {athlete_id}'
+        user.access_token = bench_token(athlete_id)
+        user.refresh_token = bench_token(athlete_id)
+        user.expires_at = int(time.time()) + 365 * 24 * 60 * 60
+        user.scope = 'read,activity:read_all'
+        user.shoes = json.dumps(shoe_data)
+        shoe_app.replace_shoes(athlete_id, shoe_data)
+        db.session.commit()
+        shoe_app.invalidate_shoe_mapping(athlete_id)
+
+        rows = athlete_activities(athlete_id, activities, shoes)
+        for i in range(0, len(rows), PAGE_SIZE):
+            shoe_app.store_activities_in_database(user, rows[i:i + PAGE_SIZE])
+        user.last_synced_at = max(shoe_app.activity_start_timestamp(row) for row in rows) if rows else None
+        db.session.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', required=True, help='SQLAlchemy URI of the database to fill')
+    parser.add_argument('--athletes', type=int, default=50)
+    parser.add_argument('--activities', type=int, default=2000, help='Activities per athlete')
+    parser.add_argument('--shoes', type=int, default=5, help='Shoes per athlete')
+    args = parser.parse_args()
+
+    # create_app() reads DATABASE_URL
+    os.environ['DATABASE_URL'] = args.database
+    start = time.perf_counter()
+    with shoe_app.create_app().app_context():
+        populate(args.athletes, args.activities, args.shoes)
+    elapsed = time.perf_counter() - start
+    print(f"{args.athletes} athletes x {args.activities} activities x {args.shoes} shoes "
+          f"written to {args.database} in {elapsed:.1f}s")
+
+if __name__ == '__main__':
+    main()
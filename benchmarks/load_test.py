@@ -0,0 +1,275 @@
+"""Load test the app under the Dockerfile's gunicorn settings against a stub Strava server.
+
+Fills a scratch database with benchmarks/generate_data.py, starts benchmarks/stub_strava.py and
+gunicorn with the CMD of the Dockerfile, then has concurrent clients hit /stats_page/<athlete_id>,
+/fetch_activities/<user_id> and /activities. Reports p50/p95/p99 latency and throughput per
+endpoint and writes them to a JSON file; --baseline compares against an earlier one.
+
+Run from the repository root:
+
+    python benchmarks/load_test.py --athletes 20 --activities 2000 --clients 16 --duration 30
+    cp benchmarks/results/latest.json benchmarks/results/baseline.json
+    # change app.py, then
+    python benchmarks/load_test.py --athletes 20 --activities 2000 --clients 16 --duration 30 \\
+        --baseline benchmarks/results/baseline.json
+"""
+import argparse
+import json
+import math
+import os
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import requests
+
+from stub_strava import StubStrava
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENDPOINTS = ('stats_page', 'fetch_activities', 'activities')
+
+def gunicorn_command(port):
+    # The gunicorn command line of the Dockerfile's CMD, bound to a local port
+    with open(os.path.join(ROOT, 'Dockerfile')) as dockerfile:
+        cmd = next(line for line in dockerfile if line.startswith('CMD '))
+    args = shlex.split(cmd[len('CMD '):])
+    if args[0] == 'exec':
+        args = args[1:]
+    return [f'127.0.0.1:{port}' if arg == ':$PORT' else arg for arg in args]
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_until_up(url, process, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {process.returncode}")
+        # gunicorn accepts connections before its worker has imported the app
+        try:
+            requests.get(url, timeout=5)
+            return
+        except (requests.ConnectionError, requests.Timeout):
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+def percentile(sorted_values, q):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def summarize(latencies, errors, elapsed):
+    values = sorted(latencies)
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'throughput': len(values) / elapsed if elapsed else 0.0,
+        'mean': sum(values) / len(values) if values else None,
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': values[-1] if values else None
+    }
+
+class LoadClient(threading.Thread):
+    # Sends requests for a random endpoint and athlete until the deadline
+
+    def __init__(self, base_url, endpoints, athletes, deadline, full_sync, seed):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.endpoints = endpoints
+        self.athletes = athletes
+        self.deadline = deadline
+        self.full_sync = full_sync
+        self.rng = random.Random(seed)
+        self.session = requests.Session()
+        self.latencies = {endpoint: [] for endpoint in ENDPOINTS + ('sync_job',)}
+        self.errors = {endpoint: 0 for endpoint in ENDPOINTS + ('sync_job',)}
+
+    def run(self):
+        while time.monotonic() < self.deadline:
+            endpoint = self.rng.choice(self.endpoints)
+            # generate_data.py gives athlete N the user id N
+            athlete_id = self.rng.randint(1, self.athletes)
+            if endpoint == 'stats_page':
+                self.timed(endpoint, f'/stats_page/{athlete_id}')
+            elif endpoint == 'activities':
+                self.timed(endpoint, f'/activities?athlete_id={athlete_id}&limit=1000')
+            else:
+                self.sync(athlete_id)
+
+    def timed(self, endpoint, path, expected=200):
+        start = time.perf_counter()
+        try:
+            response = self.session.get(self.base_url + path, timeout=300)
+            # Read the whole body, /activities may stream
+            response.content
+        except requests.RequestException:
+            self.errors[endpoint] += 1
+            return None
+        elapsed = time.perf_counter() - start
+        if response.status_code != expected:
+            self.errors[endpoint] += 1
+            return None
+        self.latencies[endpoint].append(elapsed)
+        return response
+
+    def sync(self, user_id):
+        # Times the 202 of /fetch_activities and, as sync_job, the time until the job finished
+        start = time.perf_counter()
+        response = self.timed('fetch_activities', f'/fetch_activities/{user_id}?full={int(self.full_sync)}',
+                              expected=202)
+        if response is None:
+            return
+        status_url = response.json()['status_url']
+        while True:
+            job = self.session.get(self.base_url + status_url, timeout=60).json()
+            if job['status'] in ('finished', 'failed'):
+                break
+            time.sleep(0.05)
+        if job['status'] == 'failed':
+            self.errors['sync_job'] += 1
+        else:
+            self.latencies['sync_job'].append(time.perf_counter() - start)
+
+def run_load(base_url, endpoints, athletes, clients, duration, full_sync):
+    deadline = time.monotonic() + duration
+    threads = [LoadClient(base_url, endpoints, athletes, deadline, full_sync, seed=i) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    results = {}
+    for endpoint in ENDPOINTS + ('sync_job',):
+        latencies = [value for thread in threads for value in thread.latencies[endpoint]]
+        errors = sum(thread.errors[endpoint] for thread in threads)
+        if latencies or errors:
+            results[endpoint] = summarize(latencies, errors, elapsed)
+    return results, elapsed
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(results, baseline=None):
+    print(f"{'endpoint':<18}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, stats in results.items():
+        line = (f"{endpoint:<18}{stats['requests']:>9}{stats['errors']:>8}{stats['throughput']:>9.1f}"
+                + ''.join(f"{stats[q] * 1000 if stats[q] is not None else float('nan'):>10.1f}"
+                          for q in ('p50', 'p95', 'p99')))
+        print(line)
+        before = (baseline or {}).get(endpoint)
+        if before:
+            changes = []
+            for q in ('p50', 'p95', 'p99'):
+                if before[q] and stats[q] is not None:
+                    changes.append(f"{q} {(stats[q] / before[q] - 1) * 100:+.0f}%")
+            if before['throughput']:
+                changes.append(f"req/s {(stats['throughput'] / before['throughput'] - 1) * 100:+.0f}%")
+            print(f"{'':<18}vs baseline: {', '.join(changes)}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--athletes', type=int, default=20)
+    parser.add_argument('--activities', type=int, default=2000, help='Activities per athlete')
+    parser.add_argument('--shoes', type=int, default=5, help='Shoes per athlete')
+    parser.add_argument('--clients', type=int, default=16, help='Concurrent clients')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds of load')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS),
+                        help='Comma separated subset of ' + ', '.join(ENDPOINTS))
+    parser.add_argument('--incremental', action='store_true',
+                        help='Request incremental syncs, which find nothing new, instead of full ones')
+    parser.add_argument('--strava-latency', type=float, default=0.05, help='Seconds per stub Strava response')
+    parser.add_argument('--database', help='Reuse this SQLAlchemy URI instead of generating a scratch database')
+    parser.add_argument('--output', default=os.path.join(ROOT, 'benchmarks', 'results', 'latest.json'))
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    args = parser.parse_args()
+
+    endpoints = [endpoint.strip() for endpoint in args.endpoints.split(',') if endpoint.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = args.database or f'sqlite:///{os.path.join(tmp, "bench.db")}'
+        if not args.database:
+            subprocess.run([sys.executable, os.path.join(ROOT, 'benchmarks', 'generate_data.py'),
+                            '--database', database, '--athletes', str(args.athletes),
+                            '--activities', str(args.activities), '--shoes', str(args.shoes)],
+                           cwd=ROOT, check=True)
+
+        stub = StubStrava(args.activities, args.shoes, latency=args.strava_latency).start()
+        port = free_port()
+        env = dict(os.environ,
+                   PORT=str(port),
+                   DATABASE_URL=database,
+                   PLOT_CACHE_DIR=os.path.join(tmp, 'plot_cache'),
+                   STRAVA_API_URL=f'{stub.url}/api/v3',
+                   STRAVA_OAUTH_URL=f'{stub.url}/oauth',
+                   LOG_LEVEL=os.getenv('LOG_LEVEL', 'WARNING'))
+        command = gunicorn_command(port)
+        print("Starting", ' '.join(command))
+        server = subprocess.Popen(command, cwd=ROOT, env=env)
+        base_url = f'http://127.0.0.1:{port}'
+        try:
+            wait_until_up(base_url + '/metrics', server)
+            results, elapsed = run_load(base_url, endpoints, args.athletes, args.clients, args.duration,
+                                        full_sync=not args.incremental)
+            server_metrics = requests.get(base_url + '/metrics', timeout=10).text
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+            stub.stop()
+
+    report = {
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'git_revision': git_revision(),
+        'command': ' '.join(command),
+        'config': {
+            'athletes': args.athletes,
+            'activities': args.activities,
+            'shoes': args.shoes,
+            'clients': args.clients,
+            'duration': args.duration,
+            'endpoints': endpoints,
+            'full_sync': not args.incremental,
+            'strava_latency': args.strava_latency
+        },
+        'elapsed': elapsed,
+        'results': results
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2)
+    # The span histograms of the run, to see which stage a regression comes from
+    with open(os.path.splitext(args.output)[0] + '.metrics.txt', 'w') as output:
+        output.write(server_metrics)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline['config'] != report['config']:
+            print("Warning: the baseline was run with a different configuration:", baseline['config'])
+        baseline = baseline['results']
+    print_results(results, baseline)
+    print(f"Results written to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+"""Stub of the Strava API and OAuth endpoints for load testing.
+
+Serves the activities benchmarks/generate_data.py stored for each athlete, with Strava's paging,
+rate limits and an optional artificial latency. Like Strava, it counts requests per 15 minute
+window and per day, reports them in the X-RateLimit headers and answers 429 once either budget is
+spent. It can also inject failures: --error-rate answers a share of requests with 503 or 429, and
+StubStrava.inject() scripts the statuses of the next requests. Run it on its own with
+
+    python benchmarks/stub_strava.py --port 8081 --activities 2000 --shoes 5
+
+and start the app with STRAVA_API_URL=http://127.0.0.1:8081/api/v3 and
+STRAVA_OAUTH_URL=http://127.0.0.1:8081/oauth, or let benchmarks/load_test.py do both.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from generate_data import athlete_activities, bench_token
+from synthetic import make_shoes
+
+class StubStrava:
+    WINDOW = 15 * 60
+    DAY = 24 * 60 * 60
+
+    def __init__(self, activities, shoes, latency=0.0, rate_limit=(100000, 1000000), error_rate=0.0,
+                 clock=time.time, host='127.0.0.1', port=0):
+        self.activities = activities
+        self.shoes = shoes
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self.clock = clock  # Decides the rate limit windows, a fake clock lets checks skip ahead
+        self.requests = 0  # Every request received, also the failed ones
+        self.requests_by_path = {}
+        self.short_usage = 0
+        self.daily_usage = 0
+        self._window = None
+        self._day = None
+        self._faults = []  # Statuses of the next requests, see inject()
+        self._random = random.Random(0)
+        self._lock = threading.Lock()
+        self._activities = {}  # athlete_id -> [(start timestamp, activity)] in start order
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='stub-strava', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def inject(self, *statuses):
+        # The next len(statuses) requests are answered with these statuses instead, in order. A 429
+        # reports the 15 minute budget as spent, like Strava does.
+        with self._lock:
+            self._faults.extend(statuses)
+
+    def admit(self, path):
+        # Counts a request and returns the status to fail it with, None to serve it
+        with self._lock:
+            self.requests += 1
+            self.requests_by_path[path] = self.requests_by_path.get(path, 0) + 1
+            now = self.clock()
+            window, day = int(now // self.WINDOW), int(now // self.DAY)
+            if window != self._window:
+                self._window = window
+                self.short_usage = 0
+            if day != self._day:
+                self._day = day
+                self.daily_usage = 0
+            if self._faults:
+                status = self._faults.pop(0)
+                if status == 429:
+                    self.short_usage = max(self.short_usage, self.rate_limit[0])
+                return status
+            # Strava counts the requests it refuses for the rate limit too
+            self.short_usage += 1
+            self.daily_usage += 1
+            if self.short_usage > self.rate_limit[0] or self.daily_usage > self.rate_limit[1]:
+                return 429
+            if self.error_rate and self._random.random() < self.error_rate:
+                return self._random.choice((503, 429))
+            return None
+
+    def athlete_activities(self, athlete_id):
+        # Generated once per athlete, with the start timestamps for the after/before filters
+        rows = self._activities.get(athlete_id)
+        if rows is None:
+            rows = [(activity_timestamp(row), row)
+                    for row in athlete_activities(athlete_id, self.activities, self.shoes)]
+            self._activities[athlete_id] = rows
+        return rows
+
+    def activities_page(self, athlete_id, page, per_page, after, before):
+        rows = [row for timestamp, row in self.athlete_activities(athlete_id)
+                if timestamp > after and (before is None or timestamp < before)]
+        return rows[(page - 1) * per_page:page * per_page]
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, status, body):
+                data = json.dumps(body).encode()
+                with stub._lock:
+                    usage = f'{stub.short_usage},{stub.daily_usage}'
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.send_header('X-RateLimit-Limit', '%d,%d' % stub.rate_limit)
+                self.send_header('X-RateLimit-Usage', usage)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def send_fault(self):
+                # Counts the request, answers it with an injected or rate limit status if there is one.
+                # Returns True when the request was answered.
+                status = stub.admit(urlparse(self.path).path)
+                if status is None:
+                    return False
+                message = 'Rate Limit Exceeded' if status == 429 else HTTPStatus(status).phrase
+                self.send_json(status, {'message': message})
+                return True
+
+            def athlete_id(self):
+                # Tokens handed out by generate_data.py look like 'bench-<athlete_id>'
+                token = self.headers.get('Authorization', '').removeprefix('Bearer ')
+                try:
+                    return int(token.removeprefix('bench-'))
+                except ValueError:
+                    return None
+
+            def do_GET(self):
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if self.send_fault():
+                    return
+                url = urlparse(self.path)
+                athlete_id = self.athlete_id()
+                if athlete_id is None:
+                    return self.send_json(401, {'message': 'Authorization Error'})
+
+                if url.path.endswith('/athlete'):
+                    return self.send_json(200, {
+                        'id': athlete_id,
+                        'firstname': 'Athlete',
+                        'lastname': str(athlete_id),
+                        'shoes': make_shoes(athlete_id, stub.shoes)
+                    })
+                if url.path.endswith('/athlete/activities'):
+                    query = parse_qs(url.query)
+                    page = int(query.get('page', ['1'])[0])
+                    per_page = int(query.get('per_page', ['30'])[0])
+                    after = int(query.get('after', ['0'])[0])
+                    before = int(query['before'][0]) if 'before' in query else None
+                    return self.send_json(200, stub.activities_page(athlete_id, page, per_page, after, before))
+                self.send_json(404, {'message': 'Record Not Found'})
+
+            def do_POST(self):
+                if stub.latency:
+                    time.sleep(stub.latency)
+                length = int(self.headers.get('Content-Length', 0))
+                form = parse_qs(self.rfile.read(length).decode())
+                if self.send_fault():
+                    return
+                url = urlparse(self.path)
+                if url.path.endswith('/token'):
+                    # Refreshing hands the same token back with a new expiry
+                    token = form.get('refresh_token', [bench_token(1)])[0]
+                    athlete_id = int(token.removeprefix('bench-'))
+                    return self.send_json(200, {
+                        'access_token': bench_token(athlete_id),
+                        'refresh_token': bench_token(athlete_id),
+                        'expires_at': int(time.time()) + 6 * 60 * 60,
+                        'scope': 'read,activity:read_all',
+                        'athlete': {'id': athlete_id}
+                    })
+                if url.path.endswith('/deauthorize'):
+                    return self.send_json(200, {})
+                self.send_json(404, {'message': 'Record Not Found'})
+
+        return Handler
+
+def activity_timestamp(activity):
+    start_date = datetime.strptime(activity['start_date'], '%Y-%m-%dT%H:%M:%SZ')
+    return int(start_date.replace(tzinfo=timezone.utc).timestamp())
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--activities', type=int, default=2000, help='Activities per athlete')
+    parser.add_argument('--shoes', type=int, default=5, help='Shoes per athlete')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+    parser.add_argument('--rate-limit', default='100000,1000000', help='15 minute and daily request budgets')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with 503 or 429')
+    args = parser.parse_args()
+
+    rate_limit = tuple(int(part) for part in args.rate_limit.split(','))
+    stub = StubStrava(args.activities, args.shoes, latency=args.latency, rate_limit=rate_limit,
+                      error_rate=args.error_rate, host=args.host, port=args.port)
+    print(f"Stub Strava listening on {stub.url}")
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+import random
+from datetime import datetime, timedelta
+
+# Generators for Strava-shaped data used by the benchmarks
+
+ACTIVITY_TYPES = ['Run', 'Run', 'Run', 'Ride', 'Walk', 'Swim']
+
+def make_shoes(athlete_id, count):
+    # Strava gear IDs for shoes look like 'g12345'
+    return [{'id': f'g{athlete_id}{i:03d}', 'name': f'Shoe {i + 1}'} for i in range(count)]
+
+def make_activities(count, shoes, seed=0, start_id=1, start_date=datetime(2015, 1, 1)):
+    rng = random.Random(seed)
+    activities = []
+    for i in range(count):
+        activity_type = rng.choice(ACTIVITY_TYPES)
+        distance = round(rng.uniform(3000, 25000), 1)
+        # Roughly 4:00 to 6:30 min/km, with the odd indoor activity without speed
+        average_speed = 0.0 if rng.random() < 0.01 else round(rng.uniform(2.5, 4.2), 3)
+        moving_time = int(distance / average_speed) if average_speed else rng.randint(1200, 5400)
+        start = start_date + timedelta(hours=14 * i)
+        activities.append({
+            'id': start_id + i,
+            'type': activity_type,
+            'start_date': start.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'elapsed_time': moving_time + rng.randint(0, 300),
+            'moving_time': moving_time,
+            'distance': distance,
+            'average_speed': average_speed,
+            'gear_id': rng.choice(shoes)['id'] if shoes and activity_type == 'Run' else None
+        })
+    return activities
@@ -0,0 +1,136 @@
+import glob
+import logging
+import os
+import threading
+import time
+import uuid
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# Athletes' activities as a Parquet dataset, partitioned per athlete (hive style), for analytics
+# that would otherwise scan the Activity table:
+#
+#   <COLUMNAR_DIR>/athlete_id=<athlete_id>/<stamp>-<id>.parquet
+#
+# Every sync appends the rows it stored as a new file. An activity updated by a later sync then
+# appears in several files, readers keep the row from the newest one. Once an athlete has more
+# than COMPACT_AFTER files they are merged into one. Offline, the whole dataset can be opened with
+# pyarrow.dataset.dataset(COLUMNAR_DIR, partitioning='hive'), keeping the newest row the same way.
+#
+# Imported on first use like stats.py, since pyarrow is slow to import.
+
+logger = logging.getLogger(__name__)
+
+COLUMNAR_DIR = os.getenv('COLUMNAR_DIR')
+COMPACT_AFTER = int(os.getenv('COLUMNAR_COMPACT_AFTER', '16'))
+
+SCHEMA = pa.schema([
+    ('activity_id', pa.int64()),
+    ('activity_date', pa.timestamp('us')),
+    ('activity_type', pa.string()),
+    ('elapsed_time', pa.int64()),
+    ('moving_time', pa.int64()),
+    ('distance', pa.float64()),
+    ('average_speed', pa.float64()),
+    ('pace', pa.float64()),
+    ('gear_id', pa.string())
+])
+
+# Appends and compactions of one athlete don't overlap within a process
+_locks = {}
+_locks_lock = threading.Lock()
+
+def enabled():
+    return bool(COLUMNAR_DIR)
+
+def athlete_dir(athlete_id):
+    return os.path.join(COLUMNAR_DIR, f'athlete_id={athlete_id}')
+
+def part_files(athlete_id):
+    # Oldest first, the file names start with the time they were written
+    return sorted(glob.glob(os.path.join(athlete_dir(athlete_id), '*.parquet')))
+
+def _athlete_lock(athlete_id):
+    with _locks_lock:
+        return _locks.setdefault(athlete_id, threading.Lock())
+
+def _write(athlete_id, table, stamp=None):
+    # Written under a temporary name and renamed, so readers never see a partial file
+    directory = athlete_dir(athlete_id)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{stamp or time.time_ns():020d}-{uuid.uuid4().hex[:8]}.parquet')
+    tmp_path = path + '.tmp'
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+def append_activities(athlete_id, rows):
+    # rows are Activity column dicts as built by app.activity_row(), pace included
+    if not rows:
+        return
+    table = pa.Table.from_pylist([{name: row.get(name) for name in SCHEMA.names} for row in rows], schema=SCHEMA)
+    with _athlete_lock(athlete_id):
+        _write(athlete_id, table)
+        if len(part_files(athlete_id)) > COMPACT_AFTER:
+            _compact(athlete_id)
+
+def replace_activities(athlete_id, rows):
+    # Rewrite an athlete's dataset from scratch, e.g. from the Activity table
+    table = pa.Table.from_pylist([{name: row.get(name) for name in SCHEMA.names} for row in rows], schema=SCHEMA)
+    with _athlete_lock(athlete_id):
+        old_files = part_files(athlete_id)
+        _write(athlete_id, table)
+        _remove(old_files)
+
+def _compact(athlete_id):
+    files = part_files(athlete_id)
+    table = _read_files(files)
+    # Named after the newest file merged in, so files appended meanwhile still sort after it
+    _write(athlete_id, table, stamp=int(os.path.basename(files[-1]).split('-')[0]))
+    _remove(files)
+    logger.debug("Compacted %d Parquet files of athlete %s", len(files), athlete_id)
+
+def _remove(files):
+    for path in files:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+def _read_files(files, columns=None):
+    # Memory-mapped reads into one Arrow table; an activity found in several files keeps its newest row
+    read_columns = None if columns is None else list(dict.fromkeys(['activity_id'] + list(columns)))
+    tables = []
+    for path in files:
+        try:
+            tables.append(pq.read_table(path, columns=read_columns, memory_map=True))
+        except FileNotFoundError:
+            continue  # Compacted away since it was listed, its rows are in the compacted file
+    if not tables:
+        return SCHEMA.empty_table() if read_columns is None else SCHEMA.empty_table().select(read_columns)
+    table = pa.concat_tables(tables)
+    if len(tables) > 1:
+        # Index of the last row of every activity, in file order
+        rows = table.append_column('row', pa.array(range(table.num_rows), pa.int64()))
+        newest = rows.group_by('activity_id').aggregate([('row', 'max')])['row_max']
+        table = table.take(pc.take(newest, pc.sort_indices(newest)))
+    return table
+
+def load_activities(athlete_id, columns=None):
+    # The athlete's activities as a DataFrame, None if nothing was exported for them yet
+    if not enabled():
+        return None
+    files = part_files(athlete_id)
+    if not files:
+        return None
+    df = _read_files(files, columns).to_pandas()
+    return df if columns is None else df[list(columns)]
+
+def load_runs(athlete_id, columns):
+    # Only the runs, with the given columns
+    df = load_activities(athlete_id, list(dict.fromkeys(list(columns) + ['activity_type'])))
+    if df is None:
+        return None
+    return df.loc[df['activity_type'] == 'Run', list(columns)].reset_index(drop=True)
@@ -0,0 +1,59 @@
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+# Engine settings for the app database. SQLite is tuned so stats reads don't wait for ingest
+# commits; the connection pool is tunable for server databases such as PostgreSQL.
+
+SQLITE_JOURNAL_MODES = ('delete', 'truncate', 'persist', 'memory', 'wal', 'off')
+SQLITE_SYNCHRONOUS = ('off', 'normal', 'full', 'extra')
+
+def env_flag(name, default):
+    return os.getenv(name, default).lower() in ('1', 'true', 'yes')
+
+def is_sqlite(uri):
+    return make_url(uri).get_backend_name() == 'sqlite'
+
+def engine_options(uri):
+    # SQLALCHEMY_ENGINE_OPTIONS for the database at uri. DB_POOL_SIZE, DB_MAX_OVERFLOW and
+    # DB_POOL_TIMEOUT are passed on when set; server databases also get pre-ping and a recycle
+    # time, since idle connections are dropped by the server or a proxy in between.
+    options = {}
+    for name, option in (('DB_POOL_SIZE', 'pool_size'), ('DB_MAX_OVERFLOW', 'max_overflow'),
+                         ('DB_POOL_TIMEOUT', 'pool_timeout')):
+        if os.getenv(name):
+            options[option] = int(os.getenv(name))
+    if not is_sqlite(uri):
+        options['pool_pre_ping'] = env_flag('DB_POOL_PRE_PING', '1')
+        options['pool_recycle'] = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+    return options
+
+def configure_sqlite(engine):
+    # Set on every new connection:
+    # - WAL: readers see the last commit instead of waiting for a writer, and the writer doesn't
+    #   wait for readers. The journal mode is stored in the database file.
+    # - synchronous=NORMAL: with WAL, commits only fsync at checkpoints. A power loss can drop the
+    #   last commits but never corrupts the database.
+    # - busy_timeout: a second writer waits this many milliseconds for the lock instead of failing
+    #   with "database is locked".
+    journal_mode = os.getenv('SQLITE_JOURNAL_MODE', 'wal')
+    synchronous = os.getenv('SQLITE_SYNCHRONOUS', 'normal')
+    busy_timeout = int(os.getenv('SQLITE_BUSY_TIMEOUT', '30000'))
+    if journal_mode.lower() not in SQLITE_JOURNAL_MODES:
+        raise ValueError(f"SQLITE_JOURNAL_MODE must be one of {', '.join(SQLITE_JOURNAL_MODES)}")
+    if synchronous.lower() not in SQLITE_SYNCHRONOUS:
+        raise ValueError(f"SQLITE_SYNCHRONOUS must be one of {', '.join(SQLITE_SYNCHRONOUS)}")
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f'PRAGMA busy_timeout = {busy_timeout}')
+            # Switching the journal mode takes a lock, so only switch a database that isn't in it yet.
+            # An in-memory database has no WAL and keeps its 'memory' journal.
+            if cursor.execute('PRAGMA journal_mode').fetchone()[0] != journal_mode.lower():
+                cursor.execute(f'PRAGMA journal_mode = {journal_mode}')
+            cursor.execute(f'PRAGMA synchronous = {synchronous}')
+        finally:
+            cursor.close()
@@ -0,0 +1,13 @@
+import os
+
+# gunicorn reads this file from the working directory on startup; the server settings themselves
+# stay on the command line in the Dockerfile.
+
+def post_fork(server, worker):
+    # PRELOAD_ANALYTICS=1 imports pandas and matplotlib and starts the plot rendering pool in each
+    # worker before it serves, trading a slower boot for a fast first stats page. By default the
+    # pool starts in the background on the first stats page that renders a plot, which renders
+    # inline, so instances that never render plots never start it.
+    if os.getenv('PRELOAD_ANALYTICS', '0').lower() in ('1', 'true', 'yes'):
+        import app
+        app.preload_analytics()
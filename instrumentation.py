@@ -0,0 +1,115 @@
+import cProfile
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Timed spans around the stages of the stats pipeline, the activity sync and Strava calls,
+# exposed in the Prometheus text format by /metrics
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class SpanMetrics:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._spans = {}  # span name -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, name, seconds):
+        with self._lock:
+            span = self._spans.get(name)
+            if span is None:
+                span = self._spans[name] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    span[i] += 1
+            span[len(self.buckets)] += 1
+            span[-1] += seconds
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        # Decorator form of span()
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def render(self, metric='shoe_insights_span_seconds'):
+        with self._lock:
+            spans = {name: list(values) for name, values in self._spans.items()}
+        lines = [
+            f'# HELP {metric} Time spent in each instrumented stage.',
+            f'# TYPE {metric} histogram'
+        ]
+        for name in sorted(spans):
+            values = spans[name]
+            for bound, count in zip(self.buckets, values):
+                lines.append(f'{metric}_bucket{{span="{name}",le="{bound}"}} {count}')
+            lines.append(f'{metric}_bucket{{span="{name}",le="+Inf"}} {values[len(self.buckets)]}')
+            lines.append(f'{metric}_sum{{span="{name}"}} {values[-1]}')
+            lines.append(f'{metric}_count{{span="{name}"}} {values[len(self.buckets)]}')
+        return '\n'.join(lines) + '\n'
+
+def render_gauges(prefix, values, help_text):
+    # Prometheus gauges from a dict of numbers, None values are left out
+    lines = []
+    for key, value in values.items():
+        if value is None:
+            continue
+        name = f'{prefix}_{key}'
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        lines.append(f'{name} {value}')
+    return '\n'.join(lines) + '\n' if lines else ''
+
+metrics = SpanMetrics()
+span = metrics.span
+timed = metrics.timed
+
+class RequestProfiler:
+    # Optional cProfile of requests, dumped to <directory>/<time>-<endpoint>.prof for pstats or
+    # snakeviz. Profiles only the request thread, not the sync or plot workers. One request is
+    # profiled at a time: from Python 3.12 cProfile uses the process-wide sys.monitoring, so a
+    # second enabled profiler raises ValueError. Requests overlapping a profiled one are skipped.
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        if not self._lock.acquire(blocking=False):
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler (e.g. a debugger) holds sys.monitoring
+            self._lock.release()
+            return
+        self._local.profile = profile
+
+    def stop(self, endpoint):
+        profile = getattr(self._local, 'profile', None)
+        if profile is None:
+            return
+        try:
+            profile.disable()
+        finally:
+            self._local.profile = None
+            self._lock.release()
+        filename = f'{time.strftime("%Y%m%dT%H%M%S")}-{time.perf_counter_ns()}-{endpoint or "unknown"}.prof'
+        profile.dump_stats(os.path.join(self.directory, filename))
@@ -0,0 +1,131 @@
+import itertools
+import logging
+import threading
+import queue
+import time
+from collections import OrderedDict
+
+# In-process queue running activity syncs on background threads instead of request threads
+
+logger = logging.getLogger(__name__)
+
+class SyncJob:
+    def __init__(self, job_id, user_id, full):
+        self.id = job_id
+        self.user_id = user_id
+        self.full = full
+        self.status = 'queued'  # queued -> running -> finished | failed
+        self.pages_fetched = 0
+        self.rows_upserted = 0
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def progress(self, pages_fetched, rows_upserted):
+        self.pages_fetched = pages_fetched
+        self.rows_upserted = rows_upserted
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'user_id': self.user_id,
+            'full': self.full,
+            'status': self.status,
+            'pages_fetched': self.pages_fetched,
+            'rows_upserted': self.rows_upserted,
+            'error': self.error,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at
+        }
+
+class SyncQueue:
+    def __init__(self, run_job, workers=2, keep_finished=1000):
+        # run_job(job) does the actual sync and is called inside the context of the app passed to init_app()
+        self.app = None
+        self.run_job = run_job
+        self.workers = workers
+        self.keep_finished = keep_finished
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()  # job_id -> SyncJob, oldest first
+        self._active = {}  # user_id -> queued or running SyncJob
+        self._follow_ups = {}  # user_id -> full SyncJob queued behind a running incremental one
+        self._queue = queue.Queue()
+        self._threads = []
+
+    def init_app(self, app):
+        self.app = app
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'sync-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def enqueue(self, user_id, full=False):
+        self.start()
+        with self._lock:
+            # A sync already queued for this user absorbs the new request. A running one absorbs it
+            # too, unless a full sync is asked for while an incremental one runs: that full sync
+            # is queued once, to start when the running one is done.
+            job = self._active.get(user_id)
+            if job is not None:
+                if job.status == 'queued':
+                    job.full = job.full or full
+                    return job
+                follow_up = self._follow_ups.get(user_id)
+                if follow_up is not None:
+                    return follow_up
+                if not full or job.full:
+                    return job
+                follow_up = self._new_job(user_id, full)
+                self._follow_ups[user_id] = follow_up
+                return follow_up
+
+            job = self._new_job(user_id, full)
+            self._active[user_id] = job
+        self._queue.put(job)
+        return job
+
+    def _new_job(self, user_id, full):
+        job = SyncJob(next(self._ids), user_id, full)
+        self._jobs[job.id] = job
+        self._forget_finished()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_at is not None]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            # Statuses change under the lock, enqueue() decides on them
+            with self._lock:
+                job.status = 'running'
+            status = 'failed'
+            try:
+                with self.app.app_context():
+                    self.run_job(job)
+                status = 'finished'
+            except Exception as e:
+                job.error = str(e)
+                logger.exception("Sync job %s for user %s failed", job.id, job.user_id)
+            finally:
+                with self._lock:
+                    job.status = status
+                    job.finished_at = time.time()
+                    self._active.pop(job.user_id, None)
+                    follow_up = self._follow_ups.pop(job.user_id, None)
+                    if follow_up is not None:
+                        self._active[job.user_id] = follow_up
+                        self._queue.put(follow_up)
+                self._queue.task_done()
@@ -0,0 +1,28 @@
+"""Sync high-water mark on user
+
+Revision ID: 1576a460a614
+Revises: 6fd028b8288d
+Create Date: 2026-10-17 11:02:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1576a460a614'
+down_revision = '6fd028b8288d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'last_synced_at' not in {column['name'] for column in inspector.get_columns('user')}:
+        with op.batch_alter_table('user') as batch_op:
+            batch_op.add_column(sa.Column('last_synced_at', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('last_synced_at')
@@ -0,0 +1,54 @@
+"""Per-shoe pace histograms, filled from the stored runs
+
+Revision ID: 36239eea5c46
+Revises: dbe05b041bfd
+Create Date: 2026-10-17 11:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '36239eea5c46'
+down_revision = 'dbe05b041bfd'
+branch_labels = None
+depends_on = None
+
+activity = sa.table(
+    'activity',
+    sa.column('athlete_id', sa.Integer),
+    sa.column('activity_type', sa.String),
+    sa.column('average_speed', sa.Float),
+    sa.column('gear_id', sa.String)
+)
+pace_histogram = sa.table('pace_histogram', *(sa.column(name) for name in ('athlete_id', 'gear_id', 'pace', 'runs')))
+
+
+def upgrade():
+    bind = op.get_bind()
+    if not sa.inspect(bind).has_table('pace_histogram'):
+        op.create_table(
+            'pace_histogram',
+            sa.Column('athlete_id', sa.Integer(), nullable=False),
+            sa.Column('gear_id', sa.String(length=100), nullable=False),
+            sa.Column('pace', sa.Integer(), nullable=False),
+            sa.Column('runs', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('athlete_id', 'gear_id', 'pace')
+        )
+    if bind.execute(sa.select(sa.func.count()).select_from(pace_histogram)).scalar():
+        return
+    # The same histograms as rollups.rebuild_shoe_stats(), with pace in whole seconds per kilometer
+    pace = sa.case((activity.c.average_speed > 0, sa.cast(sa.func.floor(1000 / activity.c.average_speed), sa.Integer)))
+    gear_id = sa.func.coalesce(activity.c.gear_id, '')
+    histogram = sa.select(
+        activity.c.athlete_id,
+        gear_id,
+        pace,
+        sa.func.count()
+    ).where(activity.c.activity_type == 'Run', pace.is_not(None)).group_by(activity.c.athlete_id, gear_id, pace)
+    op.execute(pace_histogram.insert().from_select([column.name for column in pace_histogram.c], histogram))
+
+
+def downgrade():
+    op.drop_table('pace_histogram')
@@ -0,0 +1,56 @@
+"""Baseline schema: user and activity tables as created by db.create_all() before migrations
+
+Revision ID: 3f1c2a9d0b6e
+Revises:
+Create Date: 2026-10-17 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d0b6e'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases created by db.create_all() already have these tables and only need the later revisions
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('user'):
+        op.create_table(
+            'user',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('athlete_id', sa.Integer(), nullable=True),
+            sa.Column('access_token', sa.String(length=255), nullable=True),
+            sa.Column('refresh_token', sa.String(length=255), nullable=True),
+            sa.Column('expires_at', sa.Integer(), nullable=True),
+            sa.Column('scope', sa.String(length=255), nullable=True),
+            sa.Column('name', sa.String(length=100), nullable=True),
+            sa.Column('shoes', sa.String(length=500), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+    if not inspector.has_table('activity'):
+        op.create_table(
+            'activity',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('athlete_id', sa.Integer(), nullable=True),
+            sa.Column('activity_id', sa.Integer(), nullable=True),
+            sa.Column('activity_date', sa.DateTime(), nullable=True),
+            sa.Column('activity_type', sa.String(length=50), nullable=True),
+            sa.Column('elapsed_time', sa.Integer(), nullable=True),
+            sa.Column('moving_time', sa.Integer(), nullable=True),
+            sa.Column('distance', sa.Float(), nullable=True),
+            sa.Column('average_speed', sa.Float(), nullable=True),
+            sa.Column('gear_id', sa.String(length=100), nullable=True),
+            sa.Column('pace', sa.Float(), nullable=True),
+            sa.ForeignKeyConstraint(['athlete_id'], ['user.athlete_id']),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+
+def downgrade():
+    op.drop_table('activity')
+    op.drop_table('user')
@@ -0,0 +1,35 @@
+"""Unique activity per athlete, the upsert key of store_activities_in_database()
+
+Revision ID: 6fd028b8288d
+Revises: 3f1c2a9d0b6e
+Create Date: 2026-10-17 11:01:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6fd028b8288d'
+down_revision = '3f1c2a9d0b6e'
+branch_labels = None
+depends_on = None
+
+activity = sa.table('activity', sa.column('id', sa.Integer), sa.column('athlete_id', sa.Integer),
+                    sa.column('activity_id', sa.Integer))
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'uq_activity_athlete_activity' in {constraint['name'] for constraint in inspector.get_unique_constraints('activity')}:
+        return
+    # Keep the newest row of any duplicates stored before activities were upserted
+    newest = sa.select(sa.func.max(activity.c.id)).group_by(activity.c.athlete_id, activity.c.activity_id)
+    op.execute(activity.delete().where(activity.c.id.not_in(newest.scalar_subquery())))
+    with op.batch_alter_table('activity') as batch_op:
+        batch_op.create_unique_constraint('uq_activity_athlete_activity', ['athlete_id', 'activity_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('activity') as batch_op:
+        batch_op.drop_constraint('uq_activity_athlete_activity', type_='unique')
@@ -0,0 +1,56 @@
+"""Gear table, filled from the shoes JSON on user
+
+Revision ID: 7931bffa91ad
+Revises: cc5b8922ae0c
+Create Date: 2026-10-17 11:07:00.000000
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7931bffa91ad'
+down_revision = 'cc5b8922ae0c'
+branch_labels = None
+depends_on = None
+
+user = sa.table('user', sa.column('athlete_id', sa.Integer), sa.column('shoes', sa.Text))
+gear = sa.table('gear', sa.column('athlete_id', sa.Integer), sa.column('gear_id', sa.String),
+                sa.column('name', sa.String))
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    shoes = next(column for column in inspector.get_columns('user') if column['name'] == 'shoes')
+    if not isinstance(shoes['type'], sa.Text):
+        with op.batch_alter_table('user') as batch_op:
+            batch_op.alter_column('shoes', type_=sa.Text(), existing_type=sa.String(length=500))
+    if not inspector.has_table('gear'):
+        op.create_table(
+            'gear',
+            sa.Column('athlete_id', sa.Integer(), nullable=False),
+            sa.Column('gear_id', sa.String(length=100), nullable=False),
+            sa.Column('name', sa.String(length=255), nullable=True),
+            sa.PrimaryKeyConstraint('athlete_id', 'gear_id')
+        )
+    # Shoes of athletes stored before the Gear table
+    athletes_with_gear = set(bind.execute(sa.select(gear.c.athlete_id).distinct()).scalars())
+    gear_rows = []
+    for athlete_id, shoes in bind.execute(sa.select(user.c.athlete_id, user.c.shoes).where(user.c.shoes.is_not(None))):
+        if athlete_id in athletes_with_gear:
+            continue
+        athletes_with_gear.add(athlete_id)
+        names = {shoe['id']: shoe['name'] for shoe in json.loads(shoes)}
+        gear_rows += [{'athlete_id': athlete_id, 'gear_id': gear_id, 'name': name} for gear_id, name in names.items()]
+    if gear_rows:
+        op.bulk_insert(gear, gear_rows)
+
+
+def downgrade():
+    op.drop_table('gear')
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.alter_column('shoes', type_=sa.String(length=500), existing_type=sa.Text())
@@ -0,0 +1,26 @@
+"""Index for paging through an athlete's activities by id
+
+Revision ID: 98068727610d
+Revises: 7931bffa91ad
+Create Date: 2026-10-17 11:08:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '98068727610d'
+down_revision = '7931bffa91ad'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'ix_activity_athlete_id' not in {index['name'] for index in inspector.get_indexes('activity')}:
+        op.create_index('ix_activity_athlete_id', 'activity', ['athlete_id', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_activity_athlete_id', table_name='activity')
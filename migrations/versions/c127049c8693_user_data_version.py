@@ -0,0 +1,28 @@
+"""Per-athlete data version, part of the plot and trends cache fingerprint
+
+Revision ID: c127049c8693
+Revises: 98068727610d
+Create Date: 2026-10-17 11:09:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c127049c8693'
+down_revision = '98068727610d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'data_version' not in {column['name'] for column in inspector.get_columns('user')}:
+        with op.batch_alter_table('user') as batch_op:
+            batch_op.add_column(sa.Column('data_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('data_version')
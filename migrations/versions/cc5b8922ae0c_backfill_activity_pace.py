@@ -0,0 +1,29 @@
+"""Backfill the pace of activities stored before it was computed on ingest
+
+Revision ID: cc5b8922ae0c
+Revises: 36239eea5c46
+Create Date: 2026-10-17 11:06:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'cc5b8922ae0c'
+down_revision = '36239eea5c46'
+branch_labels = None
+depends_on = None
+
+activity = sa.table('activity', sa.column('average_speed', sa.Float), sa.column('pace', sa.Float))
+
+
+def upgrade():
+    # Whole seconds per kilometer, as rollups.run_pace() computes it on ingest
+    pace = sa.cast(sa.func.floor(1000 / activity.c.average_speed), sa.Integer)
+    op.execute(activity.update().where(activity.c.pace.is_(None), activity.c.average_speed > 0).values(pace=pace))
+
+
+def downgrade():
+    # The pace column predates this revision and the backfilled values are still correct
+    pass
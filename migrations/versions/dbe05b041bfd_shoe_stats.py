@@ -0,0 +1,68 @@
+"""Per-shoe run totals, filled from the stored runs
+
+Revision ID: dbe05b041bfd
+Revises: dc730f71faf6
+Create Date: 2026-10-17 11:04:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'dbe05b041bfd'
+down_revision = 'dc730f71faf6'
+branch_labels = None
+depends_on = None
+
+activity = sa.table(
+    'activity',
+    sa.column('athlete_id', sa.Integer),
+    sa.column('activity_type', sa.String),
+    sa.column('distance', sa.Float),
+    sa.column('average_speed', sa.Float),
+    sa.column('gear_id', sa.String)
+)
+shoe_stats = sa.table('shoe_stats', *(sa.column(name) for name in (
+    'athlete_id', 'gear_id', 'runs', 'pace_count', 'pace_sum', 'pace_sum_sq',
+    'distance_count', 'distance_sum', 'distance_sum_sq')))
+
+
+def upgrade():
+    bind = op.get_bind()
+    if not sa.inspect(bind).has_table('shoe_stats'):
+        op.create_table(
+            'shoe_stats',
+            sa.Column('athlete_id', sa.Integer(), nullable=False),
+            sa.Column('gear_id', sa.String(length=100), nullable=False),
+            sa.Column('runs', sa.Integer(), nullable=False),
+            sa.Column('pace_count', sa.Integer(), nullable=False),
+            sa.Column('pace_sum', sa.Float(), nullable=False),
+            sa.Column('pace_sum_sq', sa.Float(), nullable=False),
+            sa.Column('distance_count', sa.Integer(), nullable=False),
+            sa.Column('distance_sum', sa.Float(), nullable=False),
+            sa.Column('distance_sum_sq', sa.Float(), nullable=False),
+            sa.PrimaryKeyConstraint('athlete_id', 'gear_id')
+        )
+    # Every stored run has a row, so an empty table (also one left by db.create_all()) needs filling
+    if bind.execute(sa.select(sa.func.count()).select_from(shoe_stats)).scalar():
+        return
+    # The same totals as rollups.rebuild_shoe_stats(), with pace in whole seconds per kilometer
+    pace = sa.case((activity.c.average_speed > 0, sa.cast(sa.func.floor(1000 / activity.c.average_speed), sa.Integer)))
+    gear_id = sa.func.coalesce(activity.c.gear_id, '')
+    totals = sa.select(
+        activity.c.athlete_id,
+        gear_id,
+        sa.func.count(),
+        sa.func.count(pace),
+        sa.func.coalesce(sa.func.sum(pace), 0),
+        sa.func.coalesce(sa.func.sum(pace * pace), 0),
+        sa.func.count(activity.c.distance),
+        sa.func.coalesce(sa.func.sum(activity.c.distance), 0),
+        sa.func.coalesce(sa.func.sum(activity.c.distance * activity.c.distance), 0)
+    ).where(activity.c.activity_type == 'Run').group_by(activity.c.athlete_id, gear_id)
+    op.execute(shoe_stats.insert().from_select([column.name for column in shoe_stats.c], totals))
+
+
+def downgrade():
+    op.drop_table('shoe_stats')
@@ -0,0 +1,29 @@
+"""Indexes for the per-athlete user and activity lookups
+
+Revision ID: dc730f71faf6
+Revises: 1576a460a614
+Create Date: 2026-10-17 11:03:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'dc730f71faf6'
+down_revision = '1576a460a614'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'ix_user_athlete_id' not in {index['name'] for index in inspector.get_indexes('user')}:
+        op.create_index('ix_user_athlete_id', 'user', ['athlete_id'])
+    if 'ix_activity_athlete_type' not in {index['name'] for index in inspector.get_indexes('activity')}:
+        op.create_index('ix_activity_athlete_type', 'activity', ['athlete_id', 'activity_type'])
+
+
+def downgrade():
+    op.drop_index('ix_activity_athlete_type', table_name='activity')
+    op.drop_index('ix_user_athlete_id', table_name='user')
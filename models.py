@@ -4,18 +4,35 @@ db = SQLAlchemy()
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    athlete_id = db.Column(db.Integer)
+    athlete_id = db.Column(db.Integer, index=True)
     access_token = db.Column(db.String(255))
     refresh_token = db.Column(db.String(255))
     expires_at = db.Column(db.Integer)
     scope = db.Column(db.String(255))
     name = db.Column(db.String(100))  # New column for user's name
-    shoes = db.Column(db.String(500))  # New column for shoe IDs and names
+    shoes = db.Column(db.Text)  # New column for shoe IDs and names, as JSON; see Gear for lookups
+    last_synced_at = db.Column(db.Integer)  # Start date (epoch) of the newest synced activity
+    data_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Bumped with every change of the athlete's runs or shoes
 
     def __repr__(self):
         return '<User %r>' % self.name
 
+class Gear(db.Model):
+    # An athlete's shoes from their Strava athlete summary, kept in step with User.shoes
+    athlete_id = db.Column(db.Integer, primary_key=True)
+    gear_id = db.Column(db.String(100), primary_key=True)
+    name = db.Column(db.String(255))
+
 class Activity(db.Model):
+    # One row per Strava activity per athlete, so a page can be upserted in bulk
+    __table_args__ = (
+        db.UniqueConstraint('athlete_id', 'activity_id', name='uq_activity_athlete_activity'),
+        # Per-athlete run queries filter on both columns
+        db.Index('ix_activity_athlete_type', 'athlete_id', 'activity_type'),
+        # Keyset pages of one athlete's activities
+        db.Index('ix_activity_athlete_id', 'athlete_id', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     athlete_id = db.Column(db.Integer, db.ForeignKey('user.athlete_id'))  # Update to match the foreign key in User
     activity_id = db.Column(db.Integer)
@@ -27,3 +44,22 @@ class Activity(db.Model):
     average_speed = db.Column(db.Float)
     gear_id = db.Column(db.String(100))
     pace = db.Column(db.Float)
+
+class ShoeStats(db.Model):
+    # Running totals of an athlete's runs per shoe, kept up to date on ingest by rollups.py
+    athlete_id = db.Column(db.Integer, primary_key=True)
+    gear_id = db.Column(db.String(100), primary_key=True)  # '' for runs without a shoe
+    runs = db.Column(db.Integer, nullable=False, default=0)
+    pace_count = db.Column(db.Integer, nullable=False, default=0)  # Runs with a speed
+    pace_sum = db.Column(db.Float, nullable=False, default=0)
+    pace_sum_sq = db.Column(db.Float, nullable=False, default=0)
+    distance_count = db.Column(db.Integer, nullable=False, default=0)
+    distance_sum = db.Column(db.Float, nullable=False, default=0)
+    distance_sum_sq = db.Column(db.Float, nullable=False, default=0)
+
+class PaceHistogram(db.Model):
+    # Number of an athlete's runs per shoe and whole-second pace, the box plot is drawn from these
+    athlete_id = db.Column(db.Integer, primary_key=True)
+    gear_id = db.Column(db.String(100), primary_key=True)  # '' for runs without a shoe
+    pace = db.Column(db.Integer, primary_key=True)  # Seconds per kilometer
+    runs = db.Column(db.Integer, nullable=False, default=0)
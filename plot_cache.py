@@ -0,0 +1,88 @@
+import os
+import tempfile
+import threading
+
+# Rendered plots kept on disk, keyed on (athlete_id, plot kind, fingerprint of the athlete's data).
+# File modification times double as the LRU order: a hit touches the file, eviction removes the
+# oldest files until the cache fits in max_bytes again.
+
+class PlotCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def filename(self, athlete_id, kind, fingerprint):
+        return f'{athlete_id}-{kind}-{fingerprint}.png'
+
+    def path(self, athlete_id, kind, fingerprint):
+        return os.path.join(self.directory, self.filename(athlete_id, kind, fingerprint))
+
+    def get(self, athlete_id, kind, fingerprint):
+        # Returns the path of the cached plot, or None if it has to be rendered
+        path = self.path(athlete_id, kind, fingerprint)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, athlete_id, kind, fingerprint, render):
+        # render(path) writes the PNG, returns the path of the cached plot
+        return self.put_all(athlete_id, fingerprint, [kind], lambda paths: render(paths[kind]))[kind]
+
+    def put_all(self, athlete_id, fingerprint, kinds, render):
+        # render({kind: path}) writes one PNG per kind, so several plots can be rendered together.
+        # They are renamed into place afterwards so readers never see a partial file.
+        tmp_paths = {}
+        try:
+            for kind in kinds:
+                fd, tmp_paths[kind] = tempfile.mkstemp(suffix='.png.tmp', dir=self.directory)
+                os.close(fd)
+            render(tmp_paths)
+            paths = {}
+            for kind in kinds:
+                paths[kind] = self.path(athlete_id, kind, fingerprint)
+                os.replace(tmp_paths.pop(kind), paths[kind])
+        finally:
+            for tmp_path in tmp_paths.values():
+                os.unlink(tmp_path)
+        for path in paths.values():
+            self.evict(keep=path)
+        return paths
+
+    def invalidate(self, athlete_id):
+        # Drop every cached plot of an athlete after their activities or shoes changed
+        prefix = f'{athlete_id}-'
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix) and name.endswith('.png'):
+                try:
+                    os.unlink(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def evict(self, keep=None):
+        # The plot just written is never evicted, even if it alone exceeds max_bytes
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if not entry.name.endswith('.png'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
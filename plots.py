@@ -0,0 +1,94 @@
+import logging
+
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.figure import Figure
+import matplotlib.ticker as ticker
+
+# Rendering of the stats page plots. Kept free of Flask and database imports so the functions
+# can run in the worker processes of a render_pool.PlotRenderer. Imported on first use, not by
+# app.py at startup, since matplotlib alone takes about half a second to import.
+
+logger = logging.getLogger(__name__)
+
+# Function to format seconds to mm:ss format on plot axes
+def format_seconds(x, pos):
+    minutes = int(x // 60)
+    seconds = int(x % 60)
+    return f"{minutes:02d}:{seconds:02d}"
+
+def rotate_xticklabels(ax):
+    for label in ax.get_xticklabels():
+        label.set_rotation(45)
+        label.set_horizontalalignment('right')
+
+# The plots are drawn on their own Figure objects instead of pyplot's global current figure,
+# so several threads can render at the same time
+
+def render_scatter_plot(shoes, average_paces, path):
+    # Scatter Plot: Shoe Performance, average paces in seconds per kilometer
+    fig = Figure(figsize=(8, 6))
+    ax = fig.subplots()
+    ax.scatter(shoes, average_paces)
+    ax.set_xlabel('Shoe')
+    ax.set_ylabel('Average Pace (min/km)')
+
+    # Set custom tick formatter for Y-axis
+    ax.yaxis.set_major_formatter(ticker.FuncFormatter(format_seconds))
+
+    rotate_xticklabels(ax)
+    fig.tight_layout()
+
+    fig.savefig(path, format='png')
+    logger.debug("Saved the scatter plot to %s", path)
+
+def render_box_plot(box_stats, path):
+    # Box Plot: Shoe Performance with outliers excluded, drawn from precomputed statistics per shoe
+    fig = Figure(figsize=(8, 6))
+    ax = fig.subplots()
+    if box_stats:
+        ax.bxp(box_stats, showfliers=False)
+    else:
+        # bxp() can't draw an empty list, e.g. before the athlete's first run
+        ax.text(0.5, 0.5, 'No runs yet', ha='center', va='center', transform=ax.transAxes)
+    ax.grid(True)
+    ax.set_ylabel('Pace (min/km)')
+    rotate_xticklabels(ax)
+
+    # Set custom tick formatter for Y-axis
+    ax.yaxis.set_major_formatter(ticker.FuncFormatter(format_seconds))
+
+    fig.tight_layout()
+    fig.savefig(path, format='png')
+    logger.debug("Saved the box plot to %s", path)
+
+def render_pace_distance_plot(df, path):
+    # Scatter Plot: Pace vs Distance
+    fig = Figure(figsize=(8, 6))
+    ax = fig.subplots()
+
+    # Define a list of colors for each shoe
+    colors = ['b', 'g', 'r', 'c', 'm', 'y', 'k']
+
+    # Loop through each unique shoe and plot its data with a different color
+    for i, (shoe, group) in enumerate(df.groupby('gear_id', observed=True)):
+        ax.scatter(group['distance'], group['pace'], label=shoe, color=colors[i % len(colors)])
+
+    ax.set_xlabel('Distance (m)')
+    ax.set_ylabel('Pace (min/km)')
+    ax.set_title('Scatter Plot: Pace vs Distance')
+
+    # Set custom tick formatter for Y-axis
+    ax.yaxis.set_major_formatter(ticker.FuncFormatter(format_seconds))
+
+    ax.legend()  # Show legend with shoe names
+    fig.tight_layout()
+
+    fig.savefig(path, format='png')
+    logger.debug("Saved the pace vs distance plot to %s", path)
+
+def warm_up():
+    # Draw a throwaway figure so a new worker has matplotlib's fonts and Agg backend loaded
+    fig = Figure(figsize=(1, 1))
+    fig.subplots().plot([0, 1])
+    fig.canvas.draw()
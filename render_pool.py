@@ -0,0 +1,107 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Process pool for the plot rendering functions of plots.py. Kept apart from plots.py so the app
+# can create a PlotRenderer without importing matplotlib.
+
+logger = logging.getLogger(__name__)
+
+def warm_up():
+    # Runs in a worker: import matplotlib and draw a throwaway figure so fonts and Agg are loaded
+    import plots
+    plots.warm_up()
+
+class PlotRenderer:
+    # Renders independent plots in parallel on a process pool, since matplotlib holds the GIL.
+    # Falls back to rendering inline when there are no workers or the pool broke.
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._pool = None
+        self._started = False  # One attempt per pool, a pool that failed to start stays inline
+        self._start_thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        # Start and warm up the workers. Safe to call from any thread and more than once: the
+        # workers are forked from a forkserver process, not from this possibly threaded one, and
+        # the forkserver imports plots.py once for all of them.
+        with self._lock:
+            if self.workers <= 0 or self._started:
+                return
+            self._started = True
+            methods = multiprocessing.get_all_start_methods()
+            if 'forkserver' not in methods and 'fork' not in methods:
+                logger.warning("Plot rendering pool unavailable, rendering inline")
+                return
+            pool = None
+            try:
+                if 'forkserver' in methods:
+                    context = multiprocessing.get_context('forkserver')
+                    context.set_forkserver_preload(['plots'])
+                else:
+                    context = multiprocessing.get_context('fork')
+                pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                for future in [pool.submit(warm_up) for _ in range(self.workers)]:
+                    future.result()
+                self._pool = pool
+            except Exception as e:
+                # Anything from a missing forkserver to a worker failing its warm-up: render inline,
+                # without leaving the workers that did start behind
+                logger.warning("Plot rendering pool unavailable, rendering inline: %s", e)
+                if pool is not None:
+                    pool.shutdown()
+
+    def start_in_background(self):
+        # start() on a thread of its own, so no request waits for the workers to warm up
+        if self.workers <= 0 or self._started or self._start_thread is not None:
+            return
+        self._start_thread = threading.Thread(target=self.start, name='plot-renderer-start', daemon=True)
+        self._start_thread.start()
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+            self._started = False
+            self._start_thread = None
+
+    def _drop(self, pool, error):
+        # A worker died, e.g. killed for running out of memory. Shut the broken pool down once and
+        # let the next render start a new one in the background.
+        with self._lock:
+            if self._pool is not pool:
+                return
+            self._pool = None
+            self._started = False
+            self._start_thread = None
+        logger.warning("Plot rendering pool broke, rendering inline until it restarts: %s", error)
+        pool.shutdown(wait=False)
+
+    def render(self, jobs, paths):
+        # jobs maps a plot kind to (render function, args), each function is called with
+        # paths[kind] appended to its args. Returns once every plot has been written. Renders
+        # inline until the pool has started.
+        self.start_in_background()
+        futures = {}
+        pool = self._pool
+        if pool is not None:
+            try:
+                for kind, (render, args) in jobs.items():
+                    futures[kind] = pool.submit(render, *args, paths[kind])
+            except (BrokenProcessPool, RuntimeError) as e:
+                self._drop(pool, e)
+
+        for kind, (render, args) in jobs.items():
+            future = futures.get(kind)
+            if future is not None:
+                try:
+                    future.result()
+                    continue
+                except BrokenProcessPool as e:
+                    self._drop(pool, e)
+            render(*args, paths[kind])
@@ -0,0 +1,172 @@
+from collections import defaultdict
+
+from models import db, Activity, ShoeStats, PaceHistogram
+
+# Per-shoe totals and pace histograms of an athlete's runs, maintained incrementally as
+# activities are stored so the stats page reads a few rows per shoe instead of every run. numpy is
+# imported by the functions that use it, app.py imports this module at startup.
+
+STAT_FIELDS = ('runs', 'pace_count', 'pace_sum', 'pace_sum_sq', 'distance_count', 'distance_sum', 'distance_sum_sq')
+
+def run_pace(average_speed):
+    # Seconds per kilometer truncated to whole seconds, None for activities without a speed
+    if average_speed is None or not average_speed > 0:
+        return None
+    return int(1000 / average_speed)
+
+def run_paces(average_speeds):
+    # run_pace() for a whole page of speeds at once, None where there is no speed
+    import numpy as np
+
+    speeds = np.array(average_speeds, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        paces = np.trunc(1000 / speeds)
+    return [float(pace) if speed > 0 else None for pace, speed in zip(paces, speeds)]
+
+def pace_expression():
+    # run_pace() as a SQL expression. CAST truncates on SQLite but rounds on PostgreSQL, so floor
+    # first to match the truncation on ingest on every backend (paces are positive).
+    return db.case((Activity.average_speed > 0, db.cast(db.func.floor(1000 / Activity.average_speed), db.Integer)))
+
+def contribution(row):
+    # The (gear_id, totals) an activity row adds to its shoe, None for anything but runs
+    if row['activity_type'] != 'Run':
+        return None
+    pace = run_pace(row['average_speed'])
+    distance = row['distance']
+    return row['gear_id'] or '', {
+        'runs': 1,
+        'pace_count': 0 if pace is None else 1,
+        'pace_sum': pace or 0,
+        'pace_sum_sq': (pace or 0) ** 2,
+        'distance_count': 0 if distance is None else 1,
+        'distance_sum': distance or 0,
+        'distance_sum_sq': (distance or 0) ** 2
+    }
+
+def apply_run_changes(athlete_id, old_rows, new_rows):
+    # Retract what old_rows (activities as currently stored) contributed and add new_rows, in the
+    # caller's transaction. Rows are dicts with activity_type, gear_id, distance and average_speed.
+    deltas = defaultdict(lambda: dict.fromkeys(STAT_FIELDS, 0))
+    histogram_deltas = defaultdict(int)
+    for rows, sign in ((old_rows, -1), (new_rows, 1)):
+        for row in rows:
+            change = contribution(row)
+            if change is None:
+                continue
+            gear_id, values = change
+            for field, value in values.items():
+                deltas[gear_id][field] += sign * value
+            pace = run_pace(row['average_speed'])
+            if pace is not None:
+                histogram_deltas[(gear_id, pace)] += sign
+
+    for gear_id, delta in deltas.items():
+        if not any(delta.values()):
+            continue  # Unchanged runs cancel out
+        # Increment in SQL so concurrent writers can't lose each other's updates
+        result = db.session.execute(
+            db.update(ShoeStats).where(
+                ShoeStats.athlete_id == athlete_id,
+                ShoeStats.gear_id == gear_id
+            ).values({field: getattr(ShoeStats, field) + value for field, value in delta.items()})
+        )
+        if result.rowcount == 0:
+            db.session.execute(db.insert(ShoeStats).values(athlete_id=athlete_id, gear_id=gear_id, **delta))
+
+    for (gear_id, pace), delta in histogram_deltas.items():
+        if delta == 0:
+            continue
+        result = db.session.execute(
+            db.update(PaceHistogram).where(
+                PaceHistogram.athlete_id == athlete_id,
+                PaceHistogram.gear_id == gear_id,
+                PaceHistogram.pace == pace
+            ).values(runs=PaceHistogram.runs + delta)
+        )
+        if result.rowcount == 0:
+            db.session.execute(db.insert(PaceHistogram).values(athlete_id=athlete_id, gear_id=gear_id,
+                                                              pace=pace, runs=delta))
+
+def rebuild_shoe_stats(athlete_id=None):
+    # Recompute the totals and histograms from the Activity table, for one athlete or everyone.
+    # The caller commits.
+    for model in (ShoeStats, PaceHistogram):
+        delete = db.delete(model)
+        if athlete_id is not None:
+            delete = delete.where(model.athlete_id == athlete_id)
+        db.session.execute(delete)
+
+    pace = pace_expression()
+    gear_id = db.func.coalesce(Activity.gear_id, '')
+    totals = db.select(
+        Activity.athlete_id,
+        gear_id,
+        db.func.count(),
+        db.func.count(pace),
+        db.func.coalesce(db.func.sum(pace), 0),
+        db.func.coalesce(db.func.sum(pace * pace), 0),
+        db.func.count(Activity.distance),
+        db.func.coalesce(db.func.sum(Activity.distance), 0),
+        db.func.coalesce(db.func.sum(Activity.distance * Activity.distance), 0)
+    ).where(Activity.activity_type == 'Run').group_by(Activity.athlete_id, gear_id)
+    if athlete_id is not None:
+        totals = totals.where(Activity.athlete_id == athlete_id)
+
+    db.session.execute(db.insert(ShoeStats).from_select(('athlete_id', 'gear_id') + STAT_FIELDS, totals))
+
+    histogram = db.select(
+        Activity.athlete_id,
+        gear_id,
+        pace,
+        db.func.count()
+    ).where(Activity.activity_type == 'Run', pace.is_not(None)).group_by(Activity.athlete_id, gear_id, pace)
+    if athlete_id is not None:
+        histogram = histogram.where(Activity.athlete_id == athlete_id)
+
+    db.session.execute(db.insert(PaceHistogram).from_select(('athlete_id', 'gear_id', 'pace', 'runs'), histogram))
+
+def backfill_paces(athlete_id=None):
+    # Fill Activity.pace for activities stored before it was computed on ingest. The caller commits.
+    update = db.update(Activity).where(Activity.pace.is_(None), Activity.average_speed > 0).values(pace=pace_expression())
+    if athlete_id is not None:
+        update = update.where(Activity.athlete_id == athlete_id)
+    db.session.execute(update)
+
+def percentile(values, cumulative_counts, q):
+    # The q-th percentile of the runs in a histogram, interpolated between neighbouring ranks the
+    # same way as numpy.percentile so the result matches the exact value over every run
+    import numpy as np
+
+    position = q / 100 * (cumulative_counts[-1] - 1)
+    lower = values[np.searchsorted(cumulative_counts, np.floor(position), side='right')]
+    upper = values[np.searchsorted(cumulative_counts, np.ceil(position), side='right')]
+    return lower + (position - np.floor(position)) * (upper - lower)
+
+def histogram_box_stats(values, counts, label, whis=1.5):
+    # Box plot statistics for Axes.bxp from a histogram, following matplotlib.cbook.boxplot_stats
+    import numpy as np
+
+    order = np.argsort(values)
+    values = np.asarray(values, dtype=float)[order]
+    counts = np.asarray(counts)[order]
+    values = values[counts > 0]
+    counts = counts[counts > 0]
+    cumulative_counts = np.cumsum(counts)
+
+    q1, med, q3 = (percentile(values, cumulative_counts, q) for q in (25, 50, 75))
+    iqr = q3 - q1
+
+    inside_high = values[values <= q3 + whis * iqr]
+    inside_low = values[values >= q1 - whis * iqr]
+    return {
+        'label': label,
+        'mean': np.average(values, weights=counts),
+        'med': med,
+        'q1': q1,
+        'q3': q3,
+        'iqr': iqr,
+        'whishi': q3 if len(inside_high) == 0 or inside_high.max() < q3 else inside_high.max(),
+        'whislo': q1 if len(inside_low) == 0 or inside_low.min() > q1 else inside_low.min(),
+        'fliers': np.array([])
+    }
@@ -0,0 +1,73 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from models import db, Gear
+
+# gear_id -> shoe name mappings per athlete, cached in process until update_user_info changes them
+
+class LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def pop_where(self, predicate):
+        # Drops every key for which predicate(key) is true
+        with self._lock:
+            for key in [key for key in self._items if predicate(key)]:
+                del self._items[key]
+
+_mappings = LRUCache(maxsize=int(os.getenv('SHOE_MAPPING_CACHE_SIZE', '1024')))
+
+def get_shoe_mapping(athlete_id):
+    # Returns {gear_id: shoe name}, empty if the athlete has no shoes. Callers must not modify it.
+    mapping = _mappings.get(athlete_id)
+    if mapping is None:
+        mapping = dict(db.session.execute(
+            db.select(Gear.gear_id, Gear.name).where(Gear.athlete_id == athlete_id)
+        ).all())
+        _mappings.put(athlete_id, mapping)
+    return mapping
+
+def invalidate_shoe_mapping(athlete_id):
+    # Call after committing a change to the athlete's shoes
+    _mappings.pop(athlete_id)
+
+def replace_shoes(athlete_id, shoe_data):
+    # Make the Gear rows of an athlete match [{'id': ..., 'name': ...}]. The caller commits.
+    names = {shoe['id']: shoe['name'] for shoe in shoe_data}
+    existing = {gear.gear_id: gear for gear in Gear.query.filter_by(athlete_id=athlete_id)}
+    for gear_id, gear in existing.items():
+        if gear_id not in names:
+            db.session.delete(gear)
+        elif gear.name != names[gear_id]:
+            gear.name = names[gear_id]
+    for gear_id, name in names.items():
+        if gear_id not in existing:
+            db.session.add(Gear(athlete_id=athlete_id, gear_id=gear_id, name=name))
+
+def backfill_gear(users):
+    # Fill the Gear table from User.shoes for athletes stored before it existed. The caller commits.
+    for user in users:
+        if user.shoes and not Gear.query.filter_by(athlete_id=user.athlete_id).first():
+            replace_shoes(user.athlete_id, json.loads(user.shoes))
@@ -0,0 +1,178 @@
+import logging
+import os
+
+import pandas as pd
+
+from instrumentation import timed
+from models import db, Activity, ShoeStats, PaceHistogram
+from rollups import histogram_box_stats
+
+# The pandas side of the stats page. Imported on first use, not by app.py at startup, since
+# pandas alone takes about half a second to import.
+
+logger = logging.getLogger(__name__)
+
+# Where load_runs() reads the runs of the pace vs distance plot: 'database' (the Activity table) or
+# 'columnar' (the Parquet dataset of columnar.py, see COLUMNAR_DIR). The table and box plot come
+# from the rollups either way.
+STATS_SOURCE = os.getenv('STATS_SOURCE', 'database')
+
+# Function to format a Series of seconds to mm:ss format, missing values become empty strings
+def convert_to_mm_ss(seconds):
+    formatted = pd.Series('', index=seconds.index, dtype=object)
+    valid = seconds.notna()
+    whole_seconds = seconds[valid].astype(int)
+    formatted[valid] = ((whole_seconds // 60).astype(str).str.zfill(2) + ':' +
+                        (whole_seconds % 60).astype(str).str.zfill(2))
+    return formatted
+
+def read_runs(athlete_id, columns):
+    # The given Activity columns of an athlete's runs, built straight from the cursor. With
+    # STATS_SOURCE=columnar they are read from the Parquet dataset once the athlete is exported.
+    df = None
+    if STATS_SOURCE == 'columnar':
+        import columnar
+        df = columnar.load_runs(athlete_id, columns)
+
+    if df is None:
+        query = db.select(*(getattr(Activity, column) for column in columns)).where(
+            Activity.athlete_id == athlete_id,
+            Activity.activity_type == 'Run'
+        )
+        df = pd.read_sql(query, db.session.connection(), coerce_float=True,
+                         parse_dates=[column for column in columns if column == 'activity_date'])
+    return df
+
+@timed('runstats.load_runs')
+def load_runs(athlete_id, shoe_mapping):
+    # Load the individual runs of an athlete, only needed by the plots that show every run.
+    # Only the plotted columns are selected.
+    df = read_runs(athlete_id, ['activity_id', 'distance', 'pace', 'gear_id'])
+
+    # An empty result comes back with object columns, runs without a speed have a NaN pace
+    df['distance'] = df['distance'].astype(float)
+    df['pace'] = df['pace'].astype(float)
+    logger.debug("Loaded %d runs of athlete %s", len(df), athlete_id)
+
+    # Replace gear IDs with shoe names in the DataFrame, mapping each distinct gear ID only once
+    if shoe_mapping:
+        df['gear_id'] = df['gear_id'].astype('category').map(shoe_mapping)
+    else:
+        df['gear_id'] = "Unknown"  # Assign a placeholder value for gear IDs if mapping is not found
+
+    return df
+
+@timed('runstats.shoe_stats_table')
+def shoe_stats_table(athlete_id, shoe_mapping):
+    # Number of runs, average pace and average distance per shoe, read from the per-shoe totals
+    # kept by rollups.py instead of aggregating every activity
+    query = db.select(
+        db.func.nullif(ShoeStats.gear_id, ''),
+        ShoeStats.runs,
+        ShoeStats.pace_sum,
+        ShoeStats.pace_count,
+        ShoeStats.distance_sum,
+        ShoeStats.distance_count
+    ).where(
+        ShoeStats.athlete_id == athlete_id,
+        ShoeStats.runs > 0
+    )
+    per_gear = pd.DataFrame(db.session.execute(query).all(),
+                            columns=['gear_id', 'runs', 'pace_sum', 'pace_count', 'distance_sum', 'distance_count'])
+
+    # Replace gear IDs with shoe names, runs with shoes missing from the mapping are left out
+    if shoe_mapping:
+        per_gear['Gear'] = per_gear['gear_id'].map(shoe_mapping)
+        per_gear = per_gear.dropna(subset=['Gear'])
+    else:
+        per_gear['Gear'] = "Unknown"  # Assign a placeholder value for gear IDs if mapping is not found
+
+    # Gear IDs sharing a shoe name end up in one row, so the means are taken from the summed parts
+    totals = per_gear.groupby('Gear')[['runs', 'pace_sum', 'pace_count', 'distance_sum', 'distance_count']].sum()
+    shoe_stats = pd.DataFrame({
+        'Number of Runs': totals['runs'],
+        'Average Pace': totals['pace_sum'] / totals['pace_count'],
+        'Average Distance': totals['distance_sum'] / totals['distance_count']
+    }).reset_index()
+    return shoe_stats[['Gear', 'Number of Runs', 'Average Pace', 'Average Distance']]
+
+@timed('runstats.box_plot_stats')
+def box_plot_stats(athlete_id, shoe_mapping):
+    # Box plot statistics per shoe from the pace histograms kept by rollups.py, without loading runs
+    query = db.select(
+        db.func.nullif(PaceHistogram.gear_id, ''),
+        PaceHistogram.pace,
+        PaceHistogram.runs
+    ).where(
+        PaceHistogram.athlete_id == athlete_id,
+        PaceHistogram.runs > 0
+    )
+    histogram = pd.DataFrame(db.session.execute(query).all(), columns=['gear_id', 'pace', 'runs'])
+
+    # Replace gear IDs with shoe names, runs with shoes missing from the mapping are left out
+    if shoe_mapping:
+        histogram['Gear'] = histogram['gear_id'].map(shoe_mapping)
+        histogram = histogram.dropna(subset=['Gear'])
+    else:
+        histogram['Gear'] = "Unknown"  # Assign a placeholder value for gear IDs if mapping is not found
+
+    return [histogram_box_stats(group['pace'].to_numpy(), group['runs'].to_numpy(), shoe)
+            for shoe, group in histogram.groupby('Gear')]
+
+# Points of the trend series: every run, or the state at the end of each day, week (from Monday)
+# or month, dated by the first day of the period
+TREND_FREQUENCIES = {'run': None, 'day': 'D', 'week': 'W-MON', 'month': 'MS'}
+
+@timed('trends.load_runs')
+def load_trend_runs(athlete_id):
+    # Date, distance, pace and shoe of every run, from the same source as load_runs()
+    return read_runs(athlete_id, ['activity_date', 'distance', 'pace', 'gear_id'])
+
+@timed('trends.compute')
+def shoe_trends(runs, shoe_mapping, days=30, window_runs=50, freq='day'):
+    # Cumulative distance (km) and rolling average pace (seconds per km) of each shoe over time,
+    # over the last `days` days and the last `window_runs` runs. Runs without a known shoe are left
+    # out. Returns [{'gear_id', 'name', 'runs', 'distance_km', 'series': [...]}], most worn first.
+    runs = runs[runs['gear_id'].isin(list(shoe_mapping)) & runs['activity_date'].notna()].copy()
+    if runs.empty:
+        # No runs, or no shoes yet (before `flask rebuild-shoe-stats` filled the Gear table)
+        return []
+    runs['distance'] = runs['distance'].astype(float).fillna(0) / 1000
+    runs['pace'] = runs['pace'].astype(float)
+    runs = runs.sort_values(['gear_id', 'activity_date'], kind='stable').reset_index(drop=True)
+
+    # Every shoe at once: the windows restart per shoe, rolling means skip runs without a pace.
+    # The rows are sorted by shoe, so the rolling results come back in row order.
+    by_shoe = runs.groupby('gear_id', sort=False)
+    runs['cumulative_distance_km'] = by_shoe['distance'].cumsum()
+    runs[f'pace_{days}d'] = (by_shoe.rolling(f'{days}D', on='activity_date', min_periods=1)['pace'].mean()
+                             .to_numpy())
+    runs[f'pace_{window_runs}_runs'] = by_shoe['pace'].rolling(window_runs, min_periods=1).mean().to_numpy()
+    columns = ['cumulative_distance_km', f'pace_{days}d', f'pace_{window_runs}_runs']
+
+    frequency = TREND_FREQUENCIES[freq]
+    if frequency is None:
+        points = runs[['gear_id', 'activity_date'] + columns]
+    else:
+        # The values after the last run of each period, taken from that run's row as a whole (a
+        # window without any paced run stays null), periods without runs are skipped
+        points = (runs.groupby('gear_id', sort=False)
+                  .resample(frequency, on='activity_date', closed='left', label='left')[columns].last(skipna=False)
+                  .dropna(subset=['cumulative_distance_km'])
+                  .reset_index())
+    points = points.round({'cumulative_distance_km': 2, f'pace_{days}d': 1, f'pace_{window_runs}_runs': 1})
+    points['date'] = points['activity_date'].dt.strftime('%Y-%m-%dT%H:%M:%SZ' if frequency is None else '%Y-%m-%d')
+    # JSON has no NaN, a window without any paced run gives null
+    points = points.astype(object).where(points.notna(), None)
+
+    totals = by_shoe.agg(runs=('distance', 'size'), distance_km=('distance', 'sum'))
+    trends = []
+    for gear_id, series in points.groupby('gear_id', sort=False):
+        trends.append({
+            'gear_id': gear_id,
+            'name': shoe_mapping[gear_id],
+            'runs': int(totals.at[gear_id, 'runs']),
+            'distance_km': round(float(totals.at[gear_id, 'distance_km']), 2),
+            'series': series[['date'] + columns].to_dict(orient='records')
+        })
+    return sorted(trends, key=lambda shoe: shoe['distance_km'], reverse=True)
@@ -0,0 +1,271 @@
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from instrumentation import timed
+
+# Every call to Strava goes through this module: one pooled session, timeouts, retries with
+# jittered backoff, and an app-wide budget following Strava's rate-limit headers.
+
+# Base URLs of the Strava API and OAuth endpoints, overridable so the app can be pointed at a local stub server
+STRAVA_API_URL = os.getenv('STRAVA_API_URL', 'https://www.strava.com/api/v3').rstrip('/')
+STRAVA_OAUTH_URL = os.getenv('STRAVA_OAUTH_URL', 'https://www.strava.com/oauth').rstrip('/')
+
+# Number of activity pages requested at the same time
+FETCH_WORKERS = int(os.getenv('STRAVA_FETCH_WORKERS', '4'))
+
+# Seconds to wait for Strava to answer, and how often a 429, 5xx or network error is retried.
+# Only requests that are safe to repeat are retried after a response or a dropped connection:
+# Strava may have processed a POST such as the single-use authorization code exchange, so a POST
+# is only retried when it failed while connecting.
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'))
+REQUEST_TIMEOUT = float(os.getenv('STRAVA_TIMEOUT', '30'))
+MAX_RETRIES = int(os.getenv('STRAVA_MAX_RETRIES', '4'))
+# The same for request threads (wait=False), which a user is waiting on
+INTERACTIVE_TIMEOUT = float(os.getenv('STRAVA_INTERACTIVE_TIMEOUT', '10'))
+INTERACTIVE_MAX_RETRIES = int(os.getenv('STRAVA_INTERACTIVE_MAX_RETRIES', '1'))
+BACKOFF_BASE = float(os.getenv('STRAVA_BACKOFF_BASE', '1'))
+BACKOFF_MAX = float(os.getenv('STRAVA_BACKOFF_MAX', '60'))
+
+class StravaAPIError(Exception):
+    def __init__(self, response=None, message=None):
+        if message is None:
+            message = f"Strava API returned {response.status_code}: {response.text}"
+        super().__init__(message)
+        self.response = response
+
+class RateLimitExceeded(StravaAPIError):
+    pass
+
+class RateLimiter:
+    # Tracks the app-wide 15 minute and daily request budgets reported by Strava in the
+    # X-RateLimit-Limit and X-RateLimit-Usage headers ('<15 minute>,<daily>'). Requests wait for
+    # the next 15 minute window when it is spent, unless they can't wait (request threads); a spent
+    # daily budget raises RateLimitExceeded.
+    # The 15 minute windows start at :00, :15, :30 and :45, the daily one at midnight UTC.
+
+    WINDOW = 15 * 60
+    DAY = 24 * 60 * 60
+
+    def __init__(self, clock=time.time, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self.short_limit = None
+        self.daily_limit = None
+        self.short_usage = 0
+        self.daily_usage = 0
+        self.in_flight = 0
+        self._window = None
+        self._day = None
+        # Counters for metrics()
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.throttled_seconds = 0.0
+        self.rejected = 0
+
+    def _roll_windows(self, now):
+        # Usage starts over when a new window begins
+        window, day = int(now // self.WINDOW), int(now // self.DAY)
+        if window != self._window:
+            self._window = window
+            self.short_usage = 0
+        if day != self._day:
+            self._day = day
+            self.daily_usage = 0
+
+    def seconds_until_window_reset(self):
+        now = self.clock()
+        return self.WINDOW - now % self.WINDOW
+
+    def acquire(self, wait=True):
+        # Reserve one request. While the 15 minute budget is spent, waits for the next window, or
+        # raises RateLimitExceeded right away when wait is False.
+        while True:
+            with self._lock:
+                now = self.clock()
+                self._roll_windows(now)
+                if self.daily_limit is not None and self.daily_usage + self.in_flight >= self.daily_limit:
+                    raise RateLimitExceeded(message="Strava daily rate limit reached")
+                if self.short_limit is None or self.short_usage + self.in_flight < self.short_limit:
+                    self.in_flight += 1
+                    self.requests += 1
+                    return
+                if not wait:
+                    self.rejected += 1
+                    raise RateLimitExceeded(message="Strava 15 minute rate limit reached")
+                seconds = self.WINDOW - now % self.WINDOW
+                self.throttled += 1
+                self.throttled_seconds += seconds
+            self.sleep(seconds)
+
+    def release(self, response=None):
+        with self._lock:
+            self.in_flight -= 1
+            if response is None:
+                return
+            limits = parse_rate_limit_header(response.headers.get('X-RateLimit-Limit'))
+            usages = parse_rate_limit_header(response.headers.get('X-RateLimit-Usage'))
+            self._roll_windows(self.clock())
+            if limits:
+                self.short_limit, self.daily_limit = limits
+            if usages:
+                self.short_usage, self.daily_usage = usages
+            elif response.status_code != 429:
+                self.short_usage += 1
+                self.daily_usage += 1
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def exhaust_window(self):
+        # A 429 means the budget is spent even if no headers said so
+        with self._lock:
+            self._roll_windows(self.clock())
+            if self.short_limit is not None:
+                self.short_usage = max(self.short_usage, self.short_limit)
+
+    def metrics(self):
+        with self._lock:
+            self._roll_windows(self.clock())
+            return {
+                'short_limit': self.short_limit,
+                'short_usage': self.short_usage,
+                'daily_limit': self.daily_limit,
+                'daily_usage': self.daily_usage,
+                'in_flight': self.in_flight,
+                'requests': self.requests,
+                'retries': self.retries,
+                'throttled': self.throttled,
+                'throttled_seconds': self.throttled_seconds,
+                'rejected': self.rejected,
+                'seconds_until_window_reset': self.seconds_until_window_reset()
+            }
+
+def parse_rate_limit_header(value):
+    # '600,30000' -> (600, 30000), None if missing or malformed
+    if not value:
+        return None
+    try:
+        short, daily = (int(part) for part in value.split(','))
+    except ValueError:
+        return None
+    return short, daily
+
+# One keep-alive connection pool and one request budget shared by every Strava call of this process
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=max(FETCH_WORKERS, 10)))
+session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=max(FETCH_WORKERS, 10)))
+rate_limiter = RateLimiter()
+
+def backoff(attempt):
+    # Full jitter: a random delay up to an exponentially growing cap
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+def failed_to_connect(error):
+    # Whether a failed request never reached Strava. A connection dropped after the request was
+    # sent (RemoteDisconnected, a reset) is a ConnectionError too, but Strava may have processed it.
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    cause = error.args[0] if error.args else None
+    return isinstance(getattr(cause, 'reason', cause), NewConnectionError)
+
+@timed('strava.request')
+def request(method, url, wait=True, **kwargs):
+    # Returns the final response; 429 and 5xx responses of idempotent requests are only returned
+    # once retries run out. Request threads pass wait=False: a spent 15 minute budget then raises
+    # RateLimitExceeded, a 429 is returned as is, and the timeout and retries are capped by
+    # STRAVA_INTERACTIVE_TIMEOUT and STRAVA_INTERACTIVE_MAX_RETRIES.
+    kwargs.setdefault('timeout', REQUEST_TIMEOUT if wait else INTERACTIVE_TIMEOUT)
+    max_retries = MAX_RETRIES if wait else min(MAX_RETRIES, INTERACTIVE_MAX_RETRIES)
+    idempotent = method.upper() in IDEMPOTENT_METHODS
+    for attempt in range(max_retries + 1):
+        rate_limiter.acquire(wait=wait)
+        response = None
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == max_retries or not (idempotent or failed_to_connect(e)):
+                raise
+        finally:
+            rate_limiter.release(response)
+
+        if response is not None:
+            if response.status_code != 429 and response.status_code < 500:
+                return response
+            if response.status_code == 429:
+                # The next acquire() waits for the window to reset if the budget is known to be spent
+                rate_limiter.exhaust_window()
+            if attempt == max_retries or not idempotent or (response.status_code == 429 and not wait):
+                return response
+
+        rate_limiter.record_retry()
+        time.sleep(backoff(attempt))
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+def get_athlete(access_token, wait=True):
+    return get(f'{STRAVA_API_URL}/athlete', wait=wait, headers={'Authorization': f'Bearer {access_token}'})
+
+def get_activities_page(access_token, page, per_page, after=0, before=None):
+    headers = {'Authorization': f'Bearer {access_token}'}
+    params = {'after': after, 'page': page, 'per_page': per_page}
+    if before is not None:
+        params['before'] = before
+    return get(f'{STRAVA_API_URL}/athlete/activities', headers=headers, params=params)
+
+def iter_activity_pages(access_token, after=0, before=None, per_page=200, workers=FETCH_WORKERS):
+    # Yields (page, activities) as pages arrive, which is not necessarily in page order.
+    # Up to `workers` pages are in flight while the caller writes the previous ones. Page 1 goes
+    # out alone and the window doubles with every full page, so a sync that finds one page or
+    # nothing new costs a single request.
+    results = queue.Queue()
+    last_page = None  # Set once a short or empty page marks the end of the history
+    next_page = 1
+    in_flight = 0
+    window = 1
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='strava-page') as pool:
+        while True:
+            # Keep the window full, without requesting past the last page
+            while in_flight < window and (last_page is None or next_page <= last_page):
+                future = pool.submit(get_activities_page, access_token, next_page, per_page, after, before)
+                future.add_done_callback(lambda f, page=next_page: results.put((page, f)))
+                next_page += 1
+                in_flight += 1
+
+            if in_flight == 0:
+                break
+
+            page, future = results.get()
+            in_flight -= 1
+            response = future.result()
+
+            if response.status_code == 429:
+                raise RateLimitExceeded(response)
+            if response.status_code != 200:
+                raise StravaAPIError(response)
+
+            activities = response.json()
+            if len(activities) == per_page:
+                window = min(workers, window * 2)
+            else:
+                # An empty page means the previous one was the last, a short page is the last
+                end = page if activities else page - 1
+                last_page = end if last_page is None else min(last_page, end)
+
+            if activities and (last_page is None or page <= last_page):
+                yield page, activities
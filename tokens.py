@@ -0,0 +1,45 @@
+import threading
+import time
+
+# Access tokens kept in memory per user and refreshed shortly before they expire. Concurrent
+# callers for the same user share one refresh: the first refreshes while the others wait for it.
+
+class TokenManager:
+    def __init__(self, refresh, margin=300):
+        # refresh(user) requests a new token from Strava, stores it on the user and returns
+        # (access_token, expires_at); margin is how many seconds before expiry to refresh
+        self.refresh = refresh
+        self.margin = margin
+        self._tokens = {}  # user id -> (access_token, expires_at)
+        self._locks = {}  # user id -> lock held while refreshing that user's token
+        self._lock = threading.Lock()
+
+    def _valid(self, token):
+        return token is not None and token[0] and (token[1] or 0) - self.margin > time.time()
+
+    def _user_lock(self, user_id):
+        with self._lock:
+            return self._locks.setdefault(user_id, threading.Lock())
+
+    def store(self, user_id, access_token, expires_at):
+        # Remember a token obtained elsewhere, e.g. from the OAuth callback
+        with self._lock:
+            self._tokens[user_id] = (access_token, expires_at)
+
+    def access_token(self, user):
+        token = self._tokens.get(user.id)
+        if self._valid(token):
+            return token[0]
+
+        with self._user_lock(user.id):
+            # Another thread may have refreshed while we waited for the lock
+            token = self._tokens.get(user.id)
+            if self._valid(token):
+                return token[0]
+
+            # Or another process, in which case the database has the new token
+            token = (user.access_token, user.expires_at)
+            if not self._valid(token):
+                token = self.refresh(user)
+            self.store(user.id, *token)
+            return token[0]